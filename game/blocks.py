@@ -89,5 +89,15 @@ COAL_ORE = Block('coal_ore', _tex_coords((1, 4), (1, 4), (1, 4)))
 IRON_ORE = Block('iron_ore', _tex_coords((2, 4), (2, 4), (2, 4)))
 GOLD_ORE = Block('gold_ore', _tex_coords((3, 4), (3, 4), (3, 4)))
 
+# Registry of all the blocks. The index of a block in this list is its identifier
+# when the world is stored. 0 is reserved for the air, and new blocks have to be
+# appended at the end, to keep the identifiers of the existing ones.
+BLOCKS = [None, DIRT, DIRT_WITH_GRASS, SAND, COBBLESTONE, BRICK_COBBLESTONE, BRICK,
+          BEDSTONE, TREE, LEAVES, SNOW, WOODEN_PLANKS, CLOUD, DIRT_WITH_SNOW, WATER,
+          STONE, STONE_WITH_SNOW, COAL_ORE, IRON_ORE, GOLD_ORE]
+
+# Identifier of each block from the registry
+BLOCK_IDS = {block: i for i, block in enumerate(BLOCKS)}
+
 # A reference to the 6 faces (sides) of the blocks:
 FACES = [(0, 1, 0), (0, -1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, 1), (0, 0, -1)]
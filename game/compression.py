@@ -0,0 +1,268 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import time
+import zlib
+
+from .utilities import *
+
+try:
+    import lzma
+except ImportError:
+    # Python can be built without it
+    lzma = None
+
+
+_LAYER_ROWS = [(x * SECTOR_SIZE + y) * SECTOR_SIZE
+               for y in range(SECTOR_SIZE) for x in range(SECTOR_SIZE)]
+"""Offset of the rows of blocks along z inside `Sector.get_block_ids`, ordered
+by height then by x."""
+
+_BYTES = [bytes((value,)) for value in range(256)]
+"""Single byte of each value"""
+
+
+def to_layers(block_ids):
+    """Reorder the result of `Sector.get_block_ids` into horizontal layers,
+    from the bottom to the top.
+
+    The terrain is made of horizontal layers (stone, dirt, air...), so the runs
+    of the same block are much longer in this order. The rows along z are
+    contiguous in both orders, so they are copied at once."""
+    size = SECTOR_SIZE
+    return b''.join([block_ids[offset:offset + size] for offset in _LAYER_ROWS])
+
+
+def from_layers(data):
+    """Reverse `to_layers`.
+
+    Layers swap the x and y axes of a cube, so this is the same operation."""
+    return to_layers(data)
+
+
+def rle_encode(block_ids):
+    """Run-length encoding of the block identifiers of a sector.
+
+    The blocks are taken by horizontal layers (see `to_layers`). Each run is
+    stored as 2 bytes: its length minus 1, then the block identifier. Longer
+    runs than 256 blocks are split."""
+    data = to_layers(block_ids)
+    count = len(data)
+    result = []
+    start = 0
+    while start < count:
+        block_id = data[start]
+        end = count - len(data[start:].lstrip(_BYTES[block_id]))
+        length = end - start
+        while length > 256:
+            result += (255, block_id)
+            length -= 256
+        result += (length - 1, block_id)
+        start = end
+    return bytes(result)
+
+
+def rle_decode(data):
+    """Reverse `rle_encode`."""
+    values = iter(data)
+    runs = [_BYTES[block_id] * (length + 1) for length, block_id in zip(values, values)]
+    return from_layers(b''.join(runs))
+
+
+def _index_bits(palette_size):
+    """Returns the number of bits used to store an index of a palette.
+
+    It is rounded up to a divisor of 8, so an index never spans two bytes."""
+    if palette_size <= 1:
+        return 0
+    bits = (palette_size - 1).bit_length()
+    for size in (1, 2, 4):
+        if bits <= size:
+            return size
+    return 8
+
+
+def palette_encode(block_ids):
+    """Palette encoding of the block identifiers of a sector.
+
+    The result is the size of the palette, the palette (the block identifiers
+    used by the sector), then the index of each block inside the palette, packed
+    on the smallest number of bits. A sector of a single kind of block only
+    stores its palette.
+    """
+    palette = bytes(sorted(set(block_ids)))
+    table = bytearray(256)
+    for index, block_id in enumerate(palette):
+        table[block_id] = index
+    indices = block_ids.translate(table)
+    bits = _index_bits(len(palette))
+    if bits == 0:
+        packed = b''
+    elif bits == 8:
+        packed = indices
+    else:
+        # Each byte of `indices[k::per_byte]` is smaller than 1 << bits, so
+        # the whole slice can be shifted at once without any carry.
+        per_byte = 8 // bits
+        value = 0
+        for k in range(per_byte):
+            value |= int.from_bytes(indices[k::per_byte], 'little') << (k * bits)
+        packed = value.to_bytes(len(indices) // per_byte, 'little')
+    return bytes((len(palette),)) + palette + packed
+
+
+def palette_decode(data):
+    """Reverse `palette_encode`."""
+    count = SECTOR_SIZE ** 3
+    palette = data[1:1 + data[0]]
+    packed = data[1 + data[0]:]
+    bits = _index_bits(len(palette))
+    if bits == 0:
+        return palette * count
+    if bits == 8:
+        indices = packed
+    else:
+        per_byte = 8 // bits
+        value = int.from_bytes(packed, 'little')
+        mask = int.from_bytes(bytes(((1 << bits) - 1,)) * len(packed), 'little')
+        indices = bytearray(count)
+        for k in range(per_byte):
+            indices[k::per_byte] = ((value >> (k * bits)) & mask).to_bytes(len(packed), 'little')
+    table = bytearray(256)
+    table[:len(palette)] = palette
+    return bytes(indices).translate(table)
+
+
+def _lzma_compress(data):
+    return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+
+def _lzma_decompress(data):
+    return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6}] if lzma is not None else None
+"""The raw format is used, the headers of the xz format are bigger than most sectors"""
+
+
+class Codec:
+    """A way to encode the block identifiers of a sector (see
+    `Sector.get_block_ids`) into bytes."""
+
+    def __init__(self, codec_id, name, encode, decode):
+        self.id = codec_id
+        """Identifier stored in the files"""
+
+        self.name = name
+        """Name used by the configuration"""
+
+        self.encode = encode
+        """Function returning the encoded bytes of block identifiers"""
+
+        self.decode = decode
+        """Function returning the block identifiers of encoded bytes"""
+
+
+CODECS = {}
+"""Mapping from identifier to the available codecs"""
+
+CODECS_BY_NAME = {}
+"""Mapping from name to the available codecs"""
+
+
+def register_codec(codec):
+    CODECS[codec.id] = codec
+    CODECS_BY_NAME[codec.name] = codec
+
+
+register_codec(Codec(0, 'raw', bytes, bytes))
+register_codec(Codec(1, 'palette', palette_encode, palette_decode))
+register_codec(Codec(2, 'rle', rle_encode, rle_decode))
+register_codec(Codec(3, 'zlib', zlib.compress, zlib.decompress))
+register_codec(Codec(4, 'rle+zlib',
+                     lambda data: zlib.compress(rle_encode(data)),
+                     lambda data: rle_decode(zlib.decompress(data))))
+if lzma is not None:
+    register_codec(Codec(5, 'rle+lzma',
+                         lambda data: _lzma_compress(rle_encode(data)),
+                         lambda data: rle_decode(_lzma_decompress(data))))
+
+
+def get_codec(name):
+    """Returns the codec of this name, or the 'rle+zlib' codec if it is not
+    available."""
+    return CODECS_BY_NAME.get(name, CODECS_BY_NAME['rle+zlib'])
+
+
+def benchmark_codecs(sectors, repeat=3):
+    """Measure each codec on a list of block identifiers of sectors.
+
+    Returns a list of (name, ratio, encoded MB/s, decoded MB/s), where the
+    ratio is the encoded size divided by the raw size.
+    """
+    raw_size = len(sectors) * SECTOR_SIZE ** 3
+    results = []
+    for codec in CODECS.values():
+        encode_time = decode_time = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoded = [codec.encode(data) for data in sectors]
+            middle = time.perf_counter()
+            decoded = [codec.decode(data) for data in encoded]
+            end = time.perf_counter()
+            assert decoded == sectors
+            if encode_time is None or middle - start < encode_time:
+                encode_time = middle - start
+            if decode_time is None or end - middle < decode_time:
+                decode_time = end - middle
+        size = sum(len(data) for data in encoded)
+        results.append((codec.name, size / raw_size,
+                        raw_size / encode_time / 1e6, raw_size / decode_time / 1e6))
+    return results
+
+
+if __name__ == '__main__':
+    # Benchmark on a generated world: python -m game.compression
+    from .genworld import WorldGenerator
+
+    for hills in (True, False):
+        generator = WorldGenerator(seed=0)
+        generator.hills_enabled = hills
+        generator.caves_enabled = CAVES_ON
+        sectors = [generator.generate((x, y, z)).get_block_ids()
+                   for x in range(-6, 6) for y in range(-2, 3) for z in range(-6, 6)]
+        print("%d sectors, %s" % (len(sectors), "hills" if hills else "flat floor"))
+        print("%-10s %8s %12s %12s" % ("codec", "ratio", "encode MB/s", "decode MB/s"))
+        for name, ratio, encode_speed, decode_speed in benchmark_codecs(sectors):
+            print("%-10s %7.2f%% %12.1f %12.1f" % (name, ratio * 100, encode_speed, decode_speed))
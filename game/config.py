@@ -64,6 +64,10 @@ LOOK_SPEED_Y = 0.15
 FOG_START = 20.0
 FOG_END = 60.0
 
+# Camera
+FIELD_OF_VIEW = 65.0    # Vertical field of view, in degrees
+NEAR_PLANE = 0.1
+
 # Size of sectors used to ease block loading.
 SECTOR_SIZE = 8
 
@@ -95,3 +99,46 @@ TERMINAL_VELOCITY = 50
 
 # Generate Hills?
 HILLS_ON = True
+
+# Carve caves in the underground?
+CAVES_ON = False
+
+# Prefetch of the sectors along the path of the player
+PREFETCH_HORIZON = 2.0          # Duration of the predicted path, in seconds
+PREFETCH_MAX_DISTANCE = 32.0    # Bound of the predicted path, in blocks
+PREFETCH_MAX_REQUESTS = 8       # Maximum number of sectors requested per update
+
+# Maximum number of sectors kept in memory
+MAX_LOADED_SECTORS = 4096
+
+# GPU memory (in bytes) used to keep the meshes of the recently hidden sectors
+MESH_CACHE_SIZE = 32 * 1024 * 1024
+
+# Extra distance (in sectors) before a shown sector is hidden again
+HIDE_MARGIN = 1
+
+# Size (in blocks) of the cache of the blocks around the player
+OCCUPANCY_GRID_SIZE = 32
+
+# Maximum number of blocks copied to the clipboard at once
+CLIPBOARD_MAX_VOLUME = 32 * 32 * 32
+
+# Number of levels of the hierarchy of empty space used by long raycasts and
+# box queries. Each level groups 2x2x2 cells of the level below. 0 disables it.
+OCCUPANCY_LEVELS = 5
+
+# Walking the hierarchy slows down the short queries. It is only used by the rays
+# of at least this length (in blocks), and by the boxes over at least this number
+# of sectors (measured with python -m game.hierarchy).
+OCCUPANCY_MIN_RAY_LENGTH = 128
+OCCUPANCY_MIN_BOX_SECTORS = 1024
+
+# Codecs of the sectors (see game/compression.py): 'raw', 'palette', 'rle',
+# 'zlib', 'rle+zlib' or 'rle+lzma'. Saves favor the size, the spilled sectors
+# favor the decoding speed.
+SAVE_CODEC = 'rle+zlib'
+SPILL_CODEC = 'zlib'
+
+# Edit journal, written between two saves so a crash does not lose the edits
+JOURNAL_FLUSH_INTERVAL = 1.0        # Maximum delay (in seconds) before an edit is written
+JOURNAL_COMPACTION_EDITS = 10000    # Number of edits before the journal is folded into the save
@@ -31,26 +31,184 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import concurrent.futures
 import random
 
 from .blocks import *
 from .utilities import *
 from game import utilities
 from .noise import Noise
+from .schematic import Schematic
+from .streaming import SectorWorker
 from .world import Sector
 
 
-class WorldGenerator:
+GENERATOR_PARAMETERS = ('seed', 'y', 'y_cloud', 'cloudiness', 'hills_enabled',
+                        'nb_trees', 'tree_chunk_size', 'enclosure', 'enclosure_size',
+                        'enclosure_height', 'caves_enabled', 'cave_threshold',
+                        'cave_depth', 'density_stride')
+"""Attributes of `WorldGenerator` which define the generated world. The same
+values always generate the same sectors."""
+
+
+def _add_plus(blocks, x, y, z, block):
+    blocks[(x, y, z)] = block
+    blocks[(x - 1, y, z)] = block
+    blocks[(x + 1, y, z)] = block
+    blocks[(x, y, z - 1)] = block
+    blocks[(x, y, z + 1)] = block
+
+
+def _add_box(blocks, x, y, z, block):
+    for i in range(9):
+        dx, dz = i // 3 - 1, i % 3 - 1
+        blocks[(x + dx, y, z + dz)] = block
+
+
+def _build_default_tree(height):
+    blocks = {}
+    if height == 0:
+        return blocks
+    if height == 1:
+        _add_plus(blocks, 0, 0, 0, LEAVES)
+        return blocks
+    if height == 2:
+        blocks[(0, 0, 0)] = TREE
+        blocks[(0, 1, 0)] = LEAVES
+        return blocks
+    y = 0
+    root_height = 2 if height >= 4 else 1
+    for _ in range(root_height):
+        blocks[(0, y, 0)] = TREE
+        y += 1
+    _add_plus(blocks, 0, y, 0, LEAVES)
+    y += 1
+    for _ in range(height - 4):
+        _add_box(blocks, 0, y, 0, LEAVES)
+        y += 1
+    _add_plus(blocks, 0, y, 0, LEAVES)
+    return blocks
+
+
+def _build_fir_tree(height):
+    blocks = {}
+    if height == 0:
+        return blocks
+    if height == 1:
+        _add_plus(blocks, 0, 0, 0, LEAVES)
+        return blocks
+    if height == 2:
+        blocks[(0, 0, 0)] = TREE
+        blocks[(0, 1, 0)] = LEAVES
+        return blocks
+    y = 0
+    blocks[(0, y, 0)] = TREE
+    y += 1
+    _add_box(blocks, 0, y, 0, LEAVES)
+    blocks[(0, y, 0)] = TREE
+    y += 1
+    h_layer = (height - 2) // 2
+    for _ in range(h_layer):
+        _add_plus(blocks, 0, y, 0, LEAVES)
+        blocks[(0, y, 0)] = TREE
+        y += 1
+    for _ in range(h_layer):
+        blocks[(0, y, 0)] = LEAVES
+        y += 1
+    return blocks
+
+
+def _build_coconut_tree(height):
+    blocks = {}
+    y = 0
+    for _ in range(height - 1):
+        blocks[(0, y, 0)] = TREE
+        y += 1
+    for distance in (1, 2, 3):
+        if distance == 2 and height < 5:
+            break
+        if distance == 3:
+            if height < 6:
+                break
+            y -= 1
+        blocks[(distance, y, 0)] = LEAVES
+        blocks[(-distance, y, 0)] = LEAVES
+        blocks[(0, y, distance)] = LEAVES
+        blocks[(0, y, -distance)] = LEAVES
+    return blocks
+
+
+DEFAULT_TREES = [Schematic.from_blocks(_build_default_tree(height)) for height in range(8)]
+"""Precompiled default trees, indexed by height. The anchor is the bottom of the trunk."""
+
+FIR_TREES = [Schematic.from_blocks(_build_fir_tree(height)) for height in range(8)]
+"""Precompiled fir trees, indexed by height"""
+
+COCONUT_TREES = [Schematic.from_blocks(_build_coconut_tree(height)) for height in range(8)]
+"""Precompiled coconut trees, indexed by height"""
+
+
+class DensityField:
+    """Sample a 3D noise on a coarse lattice covering a sector, and interpolate
+    the value of each voxel from the 8 surrounding samples (trilinear
+    interpolation).
+
+    The lattice is aligned on the world coordinates, so two neighboring sectors
+    share the same samples on their common border and the interpolated field
+    stays continuous.
+
+    A `stride` of 1 samples the noise at every voxel (full resolution).
+    """
+
+    def __init__(self, noise, chunk, stride=4):
+        self.stride = stride
+        """Distance (in block) between 2 samples of the lattice"""
+
+        self.origin = [(v // stride) * stride for v in chunk.min_block]
+        """Location of the first sample of the lattice"""
+
+        self.size = [(vmax - 1 - o) // stride + 2 for vmax, o in zip(chunk.max_block, self.origin)]
+        """Number of samples of the lattice in each direction"""
+
+        ox, oy, oz = self.origin
+        nx, ny, nz = self.size
+        self.samples = [noise.noise3(ox + i * stride, oy + j * stride, oz + k * stride)
+                        for i in range(nx)
+                        for j in range(ny)
+                        for k in range(nz)]
+        """Sampled values, stored as a flat list indexed by (i * ny + j) * nz + k"""
+
+    def get(self, x, y, z):
+        """Return the interpolated value of the field at a block location."""
+        stride = self.stride
+        ox, oy, oz = self.origin
+        _, ny, nz = self.size
+        i, fx = divmod(x - ox, stride)
+        j, fy = divmod(y - oy, stride)
+        k, fz = divmod(z - oz, stride)
+        s = self.samples
+        index = (i * ny + j) * nz + k
+        if stride == 1:
+            return s[index]
+        fx /= stride
+        fy /= stride
+        fz /= stride
+        # Interpolate along z, then y, then x
+        dy = nz
+        dx = ny * nz
+        c00 = s[index] + (s[index + 1] - s[index]) * fz
+        c01 = s[index + dy] + (s[index + dy + 1] - s[index + dy]) * fz
+        c10 = s[index + dx] + (s[index + dx + 1] - s[index + dx]) * fz
+        c11 = s[index + dx + dy] + (s[index + dx + dy + 1] - s[index + dx + dy]) * fz
+        c0 = c00 + (c01 - c00) * fy
+        c1 = c10 + (c11 - c10) * fy
+        return c0 + (c1 - c0) * fx
+
+
+class WorldGenerator(SectorWorker):
     """Generate a world model"""
 
-    def __init__(self):
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-        """This thread pool will execute one task at a time. Others are stacked,
-        waiting for execution."""
-
-        self.callback = None
-        """Callback for the result of the executor"""
+    def __init__(self, seed=None):
+        super().__init__()
 
         self.hills_enabled = True
         """If True the generator uses a procedural generation for the map.
@@ -93,8 +251,29 @@ class WorldGenerator:
         self.coal_gen = Noise(frequency=1 / (16 * 256), octaves=2, persistence=0.1)
         """Raw generator for ore"""
 
-        self.terrain_gen.randomize()
-        self.cloud_gen.randomize()
+        self.caves_enabled = False
+        """If True, caves are carved inside the underground."""
+
+        self.cave_gen = Noise(frequency=1 / (24 * 256), octaves=2)
+        """Raw generator used to carve the caves"""
+
+        self.cave_threshold = -0.4
+        """Blocks are removed where the cave density is below this value.
+        Smaller values create less caves."""
+
+        self.cave_depth = 2
+        """Caves are only carved at least this number of blocks below `y`."""
+
+        self.density_stride = 4
+        """Distance (in block) between 2 samples of the 3D noises (ore and caves).
+        Other voxels are interpolated. 1 means the noise is computed for each voxel."""
+
+        self.seed = None
+        """Seed of the random permutations of the noises"""
+
+        if seed is None:
+            seed = random.randrange(1 << 32)
+        self.set_seed(seed)
 
         self.lookup_terrain = []
 
@@ -140,21 +319,34 @@ class WorldGenerator:
         add_terrain_map(14, [DIRT, DIRT_WITH_SNOW, SNOW, SNOW])
         add_terrain_map(15, [DIRT, DIRT_WITH_SNOW, SNOW, SNOW])
 
-    def set_callback(self, callback):
-        """Set a callback called when a new sector is computed"""
-        self.callback = callback
-
-    def request_sector(self, sector):
-        """Compute the content of a sector asynchronously and return the result to a
-        callback already specified to this generator.
-        """
-
-        def send_result(future):
-            chunk = future.result()
-            self.callback(chunk)
+    def set_seed(self, seed):
+        """Initialize the noises from a seed, so the terrain can be generated
+        again identically."""
+        self.seed = seed
+        rand = random.Random(seed)
+        for noise in (self.terrain_gen, self.cloud_gen, self.cave_gen):
+            noise.randint_function = rand.randint
+            noise.randomize()
+
+    def get_parameters(self):
+        """Returns the seed and the settings of this generator as a dict, which
+        can be stored in a save."""
+        return {name: getattr(self, name) for name in GENERATOR_PARAMETERS}
+
+    def set_parameters(self, parameters):
+        """Restore the seed and the settings from the result of `get_parameters`.
+
+        It have to be done before the first request."""
+        for name in GENERATOR_PARAMETERS:
+            if name not in parameters:
+                continue
+            if name == 'seed':
+                self.set_seed(parameters[name])
+            else:
+                setattr(self, name, parameters[name])
 
-        future = self.executor.submit(self.generate, sector)
-        future.add_done_callback(send_result)
+    def compute_sector(self, sector):
+        return self.generate(sector)
 
     def _iter_xz(self, chunk):
         """Iterate all the xz block positions from a sector"""
@@ -191,6 +383,8 @@ class WorldGenerator:
             self._generate_trees(chunk)
         if not self.enclosure:
             self._generate_underworld(chunk)
+        if self.caves_enabled:
+            self._carve_caves(chunk)
 
         return chunk
 
@@ -265,123 +459,85 @@ class WorldGenerator:
         if not chunk.contains_y_range(self.y, self.y + 20):
             return
 
-        def get_biome(x, y, z):
-            """Return the biome at a location of the map plus the first empty place."""
-            nb_block, terrains = self._get_biome(x, z)
-            y = self.y - 2 + nb_block
-            block = terrains[-1]
-            return block, y
-
         sector_pos = chunk.position
         # Common root for many chunks
         # So what it is easier to generate trees between 2 chunks
         sector_root_x = (sector_pos[0] * SECTOR_SIZE // self.tree_chunk_size) * self.tree_chunk_size
         sector_root_z = (sector_pos[2] * SECTOR_SIZE // self.tree_chunk_size) * self.tree_chunk_size
-        random.seed(sector_root_x + sector_root_z)
+        changes = {}
+        for position, tree in self._iter_trees(sector_root_x, sector_root_z):
+            changes.update(tree.iter_blocks(position, chunk.min_block, chunk.max_block))
+
+        if changes:
+            chunk.set_blocks(changes)
 
-        nb_trees = random.randint(0, self.nb_trees)
+    def _iter_trees(self, root_x, root_z):
+        """Iterate the (position, schematic) of the trees of the tree chunk
+        starting at `root_x`, `root_z`.
+
+        The trees are fully contained in their tree chunk.
+        """
+        rand = random.Random(root_x + root_z)
+        nb_trees = rand.randint(0, self.nb_trees)
         n = self.enclosure_size - 3
         y_pos = self.y - 2
 
         for _ in range(nb_trees):
-            x = sector_root_x + 3 + random.randint(0, self.tree_chunk_size - 7)
-            z = sector_root_z + 3 + random.randint(0, self.tree_chunk_size - 7)
+            x = root_x + 3 + rand.randint(0, self.tree_chunk_size - 7)
+            z = root_z + 3 + rand.randint(0, self.tree_chunk_size - 7)
             if self.enclosure:
                 if x < -n + 2 or x > n - 2 or z < -n + 2 or z > n - 2:
                     continue
 
-            biome, start_pos = get_biome(x, y_pos + 1, z)
+            nb_block, terrains = self._get_biome(x, z)
+            biome = terrains[-1]
+            start_pos = y_pos + nb_block
             if biome not in [DIRT, DIRT_WITH_GRASS, SAND]:
                 continue
             if biome == SAND:
-                height = random.randint(4, 5)
-                self._create_coconut_tree(chunk, x, start_pos, z, height)
+                height = rand.randint(4, 5)
+                tree = COCONUT_TREES[height]
             elif start_pos - self.y > 6:
-                height = random.randint(3, 5)
-                self._create_fir_tree(chunk, x, start_pos, z, height)
+                height = rand.randint(3, 5)
+                tree = FIR_TREES[height]
             else:
-                height = random.randint(3, 7 - (start_pos - y_pos) // 3)
-                self._create_default_tree(chunk, x, start_pos, z, height)
-
-    def _create_plus(self, chunk, x, y, z, block):
-        chunk.add_block((x, y, z), block)
-        chunk.add_block((x - 1, y, z), block)
-        chunk.add_block((x + 1, y, z), block)
-        chunk.add_block((x, y, z - 1), block)
-        chunk.add_block((x, y, z + 1), block)
-
-    def _create_box(self, chunk, x, y, z, block):
-        for i in range(9):
-            dx, dz = i // 3 - 1, i % 3 - 1
-            chunk.add_block((x + dx, y, z + dz), block)
-
-    def _create_default_tree(self, chunk, x, y, z, height):
-        if height == 0:
-            return
-        if height == 1:
-            self._create_plus(x, y, z, LEAVES)
-            return
-        if height == 2:
-            chunk.add_block((x, y, z), TREE)
-            chunk.add_block((x, y + 1, z), LEAVES)
-            return
-        y_tree = 0
-        root_height = 2 if height >= 4 else 1
-        for _ in range(root_height):
-            chunk.add_block((x, y + y_tree, z), TREE)
-            y_tree += 1
-        self._create_plus(chunk, x, y + y_tree, z, LEAVES)
-        y_tree += 1
-        for _ in range(height - 4):
-            self._create_box(chunk, x, y + y_tree, z, LEAVES)
-            y_tree += 1
-        self._create_plus(chunk, x, y + y_tree, z, LEAVES)
-
-    def _create_fir_tree(self, chunk, x, y, z, height):
-        if height == 0:
-            return
-        if height == 1:
-            self._create_plus(chunk, x, y, z, LEAVES)
-            return
-        if height == 2:
-            chunk.add_block((x, y, z), TREE)
-            chunk.add_block((x, y + 1, z), LEAVES)
-            return
-        y_tree = 0
-        chunk.add_block((x, y + y_tree, z), TREE)
-        y_tree += 1
-        self._create_box(chunk, x, y + y_tree, z, LEAVES)
-        chunk.add_block((x, y + y_tree, z), TREE)
-        y_tree += 1
-        h_layer = (height - 2) // 2
-        for _ in range(h_layer):
-            self._create_plus(chunk, x, y + y_tree, z, LEAVES)
-            chunk.add_block((x, y + y_tree, z), TREE)
-            y_tree += 1
-        for _ in range(h_layer):
-            chunk.add_block((x, y + y_tree, z), LEAVES)
-            y_tree += 1
-
-    def _create_coconut_tree(self, chunk, x, y, z, height):
-        y_tree = 0
-        for _ in range(height - 1):
-            chunk.add_block((x, y + y_tree, z), TREE)
-            y_tree += 1
-        chunk.add_block((x + 1, y + y_tree, z), LEAVES)
-        chunk.add_block((x - 1, y + y_tree, z), LEAVES)
-        chunk.add_block((x, y + y_tree, z + 1), LEAVES)
-        chunk.add_block((x, y + y_tree, z - 1), LEAVES)
-        if height >= 5:
-            chunk.add_block((x + 2, y + y_tree, z), LEAVES)
-            chunk.add_block((x - 2, y + y_tree, z), LEAVES)
-            chunk.add_block((x, y + y_tree, z + 2), LEAVES)
-            chunk.add_block((x, y + y_tree, z - 2), LEAVES)
-        if height >= 6:
-            y_tree -= 1
-            chunk.add_block((x + 3, y + y_tree, z), LEAVES)
-            chunk.add_block((x - 3, y + y_tree, z), LEAVES)
-            chunk.add_block((x, y + y_tree, z + 3), LEAVES)
-            chunk.add_block((x, y + y_tree, z - 3), LEAVES)
+                height = rand.randint(3, 7 - (start_pos - y_pos) // 3)
+                tree = DEFAULT_TREES[height]
+            yield (x, start_pos, z), tree
+
+    def surface_height(self, x, z):
+        """Returns the height of the highest block of the column `x`, `z`, or
+        None if the column is empty.
+
+        It is computed from the terrain noise, the enclosure and the trees,
+        without generating any sector. The clouds and the caves are ignored.
+        """
+        heights = []
+        y_pos = self.y - 2
+        n = self.enclosure_size
+        if self.enclosure and -n <= x <= n and -n <= z <= n:
+            if x in (-n, n) or z in (-n, n):
+                heights.append(y_pos + self.enclosure_height - 1)
+            else:
+                heights.append(y_pos)
+        inside = not self.enclosure or (-n < x < n and -n < z < n)
+        if inside:
+            if self.hills_enabled:
+                nb_block, _terrains = self._get_biome(x, z)
+                heights.append(y_pos + nb_block)
+            else:
+                heights.append(y_pos)
+        if self.nb_trees > 0:
+            root_x = (x // self.tree_chunk_size) * self.tree_chunk_size
+            root_z = (z // self.tree_chunk_size) * self.tree_chunk_size
+            column_min = x, y_pos, z
+            column_max = x + 1, y_pos + 64, z + 1
+            for position, tree in self._iter_trees(root_x, root_z):
+                for (_, y, _), _block in tree.iter_blocks(position, column_min, column_max):
+                    heights.append(y)
+        if not heights:
+            return None
+        return max(heights)
 
     def _generate_clouds(self, chunk):
         """Generate clouds at this `self.y_cloud`.
@@ -398,18 +554,19 @@ class WorldGenerator:
             if (c + 1) * 0.5 < self.cloudiness:
                 chunk.add_block(pos, CLOUD)
 
-    def _get_stone(self, pos):
+    def _get_stone(self, pos, gold, iron, coal):
         """Returns the expected mineral at a specific location.
 
         The input location have to be already known as a stone location.
+        `gold`, `iron` and `coal` are the `DensityField` of each ore.
         """
-        v = self.gold_gen.noise3(*pos)
+        v = gold.get(*pos)
         if 0.02 < v < 0.03:
             return GOLD_ORE
-        v = self.iron_gen.noise3(*pos)
+        v = iron.get(*pos)
         if 0.015 < v < 0.03:
             return IRON_ORE
-        v = self.coal_gen.noise3(*pos)
+        v = coal.get(*pos)
         if 0.01 < v < 0.03:
             return COAL_ORE
         return STONE
@@ -417,9 +574,63 @@ class WorldGenerator:
     def _generate_underworld(self, chunk):
         if chunk.min_block[1] > self.y - 3:
             return
+        stride = self.density_stride
+        gold = DensityField(self.gold_gen, chunk, stride)
+        iron = DensityField(self.iron_gen, chunk, stride)
+        coal = DensityField(self.coal_gen, chunk, stride)
         for x, y, z in self._iter_xyz(chunk):
             if y > self.y - 2:
                 continue
             pos = x, y, z
-            block = self._get_stone(pos)
+            block = self._get_stone(pos, gold, iron, coal)
             chunk.add_block(pos, block)
+
+    def _carve_caves(self, chunk):
+        """Remove the blocks where the cave density is below `cave_threshold`.
+
+        The enclosure is never carved.
+        """
+        max_y = self.y - self.cave_depth
+        if chunk.min_block[1] > max_y:
+            return
+        if not chunk.blocks:
+            return
+        density = DensityField(self.cave_gen, chunk, self.density_stride)
+        carved = {}
+        for pos, block in chunk.blocks.items():
+            if block is BEDSTONE or pos[1] > max_y:
+                continue
+            if density.get(*pos) < self.cave_threshold:
+                carved[pos] = None
+        if carved:
+            chunk.set_blocks(carved)
+
+
+if __name__ == '__main__':
+    # Benchmark of the density stride: python -m game.genworld
+    import time
+
+    positions = [(x, y, z) for x in range(-2, 2) for y in (-3, -2) for z in range(-2, 2)]
+
+    def generate_all(stride):
+        generator = WorldGenerator(seed=0)
+        generator.enclosure = False
+        generator.caves_enabled = True
+        generator.density_stride = stride
+        start = time.perf_counter()
+        sectors = [generator.generate(position) for position in positions]
+        return time.perf_counter() - start, sectors
+
+    _, reference = generate_all(1)
+    total = len(positions) * SECTOR_SIZE ** 3
+    print("underworld with caves, %d sectors" % len(positions))
+    print("%-8s %12s %18s" % ("stride", "ms/sector", "blocks changed"))
+    for stride in (1, 2, 4, 8):
+        elapsed, sectors = generate_all(stride)
+        changed = 0
+        for sector, expected in zip(sectors, reference):
+            blocks = sector.blocks
+            changed += sum(blocks.get(pos) is not block for pos, block in expected.blocks.items())
+            changed += sum(pos not in expected.blocks for pos in blocks)
+        print("%-8d %12.1f %17.1f%%" % (stride, elapsed / len(positions) * 1000,
+                                        changed / total * 100))
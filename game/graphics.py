@@ -76,6 +76,101 @@ def setup_opengl():
     setup_fog()
 
 
+def draw_vertex_lists(mode, vertex_lists):
+    """ Draw a subset of the vertex lists of a batch.
+
+    Vertex lists sharing the same domain are drawn with a single call to
+    glMultiDrawArrays. The OpenGL state of their group have to be already set.
+
+    """
+    domains = {}
+    for vertex_list in vertex_lists:
+        if vertex_list.count:
+            domains.setdefault(vertex_list.domain, []).append(vertex_list)
+
+    for domain, lists in domains.items():
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        for buffer, attributes in domain.buffer_attributes:
+            buffer.bind()
+            for attribute in attributes:
+                attribute.enable()
+                attribute.set_pointer(attribute.buffer.ptr)
+        count = len(lists)
+        starts = (GLint * count)(*[vertex_list.start for vertex_list in lists])
+        sizes = (GLsizei * count)(*[vertex_list.count for vertex_list in lists])
+        glMultiDrawArrays(mode, starts, sizes, count)
+        for buffer, _ in domain.buffer_attributes:
+            buffer.unbind()
+        glPopClientAttrib()
+
+
+class Frustum:
+    """The volume of the world seen by the camera.
+
+    It matches the projection set by `BlockGroup`, for a camera at `position`
+    with a `rotation` (in degrees) as used by the `GameScene`.
+    """
+
+    def __init__(self, position, rotation, aspect, fov=FIELD_OF_VIEW, near=NEAR_PLANE, far=FOG_END):
+        self.position = position
+
+        x, y = rotation
+        m = math.cos(math.radians(y))
+        # Line of sight, right and up vectors of the camera
+        forward = (math.sin(math.radians(x)) * m,
+                   math.sin(math.radians(y)),
+                   -math.cos(math.radians(x)) * m)
+        right = (math.cos(math.radians(x)), 0.0, math.sin(math.radians(x)))
+        up = (right[1] * forward[2] - right[2] * forward[1],
+              right[2] * forward[0] - right[0] * forward[2],
+              right[0] * forward[1] - right[1] * forward[0])
+
+        tan_v = math.tan(math.radians(fov) / 2)
+        tan_h = tan_v * aspect
+
+        def side(tan, axis, sign):
+            return tuple(f * tan + a * sign for f, a in zip(forward, axis))
+
+        self.planes = [
+            # (normal pointing inside, offset)
+            (forward, -near),
+            (tuple(-f for f in forward), far),
+            (side(tan_h, right, -1), 0.0),
+            (side(tan_h, right, 1), 0.0),
+            (side(tan_v, up, -1), 0.0),
+            (side(tan_v, up, 1), 0.0),
+        ]
+        """Planes bounding the frustum, relative to the camera position"""
+
+    def intersects_box(self, box_min, box_max):
+        """ Returns False if the box is fully outside of the frustum.
+
+        It can return True for a few boxes outside of the frustum, close to
+        its corners.
+        """
+        px, py, pz = self.position
+        x0, y0, z0 = box_min[0] - px, box_min[1] - py, box_min[2] - pz
+        x1, y1, z1 = box_max[0] - px, box_max[1] - py, box_max[2] - pz
+        for (nx, ny, nz), offset in self.planes:
+            # Corner of the box the most inside this plane
+            d = offset
+            d += nx * (x1 if nx > 0 else x0)
+            d += ny * (y1 if ny > 0 else y0)
+            d += nz * (z1 if nz > 0 else z0)
+            if d < 0:
+                return False
+        return True
+
+    def intersects_sector(self, sector_pos):
+        """ Returns False if the sector is fully outside of the frustum.
+
+        """
+        x, y, z = sector_pos
+        box_min = (x * SECTOR_SIZE - 0.5, y * SECTOR_SIZE - 0.5, z * SECTOR_SIZE - 0.5)
+        box_max = (box_min[0] + SECTOR_SIZE, box_min[1] + SECTOR_SIZE, box_min[2] + SECTOR_SIZE)
+        return self.intersects_box(box_min, box_max)
+
+
 class BlockGroup(OrderedGroup):
     """A Group for all 3D elements, such as Blocks.
 
@@ -102,7 +197,7 @@ class BlockGroup(OrderedGroup):
         glViewport(0, 0, width, height)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(65.0, width / float(height), 0.1, 60.0)
+        gluPerspective(FIELD_OF_VIEW, width / float(height), NEAR_PLANE, FOG_END)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
         x, y = self.rotation
@@ -0,0 +1,249 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import itertools
+import math
+
+from .utilities import *
+
+
+class OccupancyHierarchy:
+    """Multi-level map of the loaded sectors which contain blocks.
+
+    The level 0 is the set of the filled sectors. A cell of the level `k`
+    covers 2**k sectors along each axis, and it is only stored if one of its
+    sectors is filled, with the number of filled sectors it contains. The empty
+    space can then be skipped by big cells: a ray or a box query crossing a
+    large empty region only visits a few cells, instead of every sector.
+    """
+
+    def __init__(self, levels=OCCUPANCY_LEVELS):
+        self.levels = levels
+        """Number of levels above the sectors"""
+
+        self.filled = set({})
+        """Positions of the sectors containing blocks"""
+
+        self.counts = [None] + [{} for _ in range(levels)]
+        """For each level above the sectors, mapping from cell position to the
+        number of filled sectors inside it"""
+
+    def update_sector(self, sector_pos, filled):
+        """Set if a sector contains blocks. A sector which is not loaded is empty."""
+        if filled == (sector_pos in self.filled):
+            return
+        if filled:
+            self.filled.add(sector_pos)
+            delta = 1
+        else:
+            self.filled.discard(sector_pos)
+            delta = -1
+        x, y, z = sector_pos
+        for level in range(1, self.levels + 1):
+            cell = x >> level, y >> level, z >> level
+            cells = self.counts[level]
+            count = cells.get(cell, 0) + delta
+            if count:
+                cells[cell] = count
+            else:
+                del cells[cell]
+
+    def get_empty_level(self, sector_pos):
+        """Returns the highest level of the empty cells containing a sector, 0
+        if only the sector itself is empty, or None if the sector is filled."""
+        if sector_pos in self.filled:
+            return None
+        x, y, z = sector_pos
+        level = 0
+        while level < self.levels:
+            cell = x >> (level + 1), y >> (level + 1), z >> (level + 1)
+            if cell in self.counts[level + 1]:
+                break
+            level += 1
+        return level
+
+    def iter_filled_sectors(self, low, high):
+        """Iterate the filled sectors between the sector positions `low` and
+        `high` (both included), skipping the empty cells."""
+        top = self.levels
+        for x in range(low[0] >> top, (high[0] >> top) + 1):
+            for y in range(low[1] >> top, (high[1] >> top) + 1):
+                for z in range(low[2] >> top, (high[2] >> top) + 1):
+                    yield from self._iter_cell(top, (x, y, z), low, high)
+
+    def _iter_cell(self, level, cell, low, high):
+        if level == 0:
+            if cell in self.filled:
+                yield cell
+            return
+        if cell not in self.counts[level]:
+            return
+        level -= 1
+        x, y, z = cell
+        for dx in (0, 1):
+            cx = (x << 1) + dx
+            if not low[0] >> level <= cx <= high[0] >> level:
+                continue
+            for dy in (0, 1):
+                cy = (y << 1) + dy
+                if not low[1] >> level <= cy <= high[1] >> level:
+                    continue
+                for dz in (0, 1):
+                    cz = (z << 1) + dz
+                    if not low[2] >> level <= cz <= high[2] >> level:
+                        continue
+                    yield from self._iter_cell(level, (cx, cy, cz), low, high)
+
+
+def _brute_force_raycast(model, position, vector, max_distance):
+    """Returns the first block hit by a ray, by testing the ray against every
+    block of the sectors around it. Used to check `Model.raycast`."""
+    length = math.sqrt(sum(v * v for v in vector))
+    direction = [v / length for v in vector]
+    end = [p + d * max_distance for p, d in zip(position, direction)]
+    sector_low = sectorize([math.floor(min(a, b) - 0.5) for a, b in zip(position, end)])
+    sector_high = sectorize([math.ceil(max(a, b) + 0.5) for a, b in zip(position, end)])
+    best = None
+    for sector_pos in itertools.product(*[range(a, b + 1) for a, b in zip(sector_low, sector_high)]):
+        sector = model.sectors.get(sector_pos)
+        if sector is None:
+            continue
+        for block in sector.blocks:
+            t_enter, t_exit = -math.inf, math.inf
+            for p, d, b in zip(position, direction, block):
+                if d == 0:
+                    if not b - 0.5 <= p <= b + 0.5:
+                        break
+                    continue
+                t1, t2 = (b - 0.5 - p) / d, (b + 0.5 - p) / d
+                t_enter = max(t_enter, min(t1, t2))
+                t_exit = min(t_exit, max(t1, t2))
+            else:
+                if t_enter <= t_exit and t_exit >= 0 and t_enter <= max_distance:
+                    if best is None or t_enter < best[0]:
+                        best = t_enter, block
+    return None if best is None else best[1]
+
+
+if __name__ == '__main__':
+    # Property tests and benchmark on a generated world: python -m game.hierarchy
+    import random
+    import time
+
+    import pyglet
+    pyglet.options['shadow_window'] = False
+
+    from .blocks import STONE
+    from .genworld import WorldGenerator
+    from .world import Model, iter_box
+
+    rng = random.Random(0)
+    generator = WorldGenerator(seed=0)
+    model = Model(None, None)
+    radius = 16
+    for x in range(-radius, radius):
+        for y in range(-2, 5):
+            for z in range(-radius, radius):
+                sector = generator.generate((x, y, z))
+                if y >= 2 and rng.random() < 0.05:
+                    # Some floating blocks in the sky
+                    xmin, ymin, zmin = sector.min_block
+                    sector.add_block((xmin + rng.randrange(SECTOR_SIZE),
+                                      ymin + rng.randrange(SECTOR_SIZE),
+                                      zmin + rng.randrange(SECTOR_SIZE)), STONE)
+                model.register_sector(sector)
+    print("%d sectors" % len(model.sectors))
+
+    def random_ray(length):
+        size = radius * SECTOR_SIZE - length // 2
+        position = (rng.uniform(-size, size), rng.uniform(0, 32), rng.uniform(-size, size))
+        vector = (rng.uniform(-1, 1), rng.uniform(-1, 0.5), rng.uniform(-1, 1))
+        return position, vector
+
+    def random_box(size):
+        span = radius * SECTOR_SIZE
+        height = min(size, 32)
+        low = (rng.randrange(-span, span - size + 1), rng.randrange(-16, 40 - height),
+               rng.randrange(-span, span - size + 1))
+        return low, (low[0] + size - 1, low[1] + height - 1, low[2] + size - 1)
+
+    hierarchy = model.hierarchy
+    default_min_ray, default_min_box = model.hierarchy_min_ray, model.hierarchy_min_box
+    # Always use the hierarchy when it is set
+    model.hierarchy_min_ray = model.hierarchy_min_box = 0
+
+    # Property tests against brute force
+    for _ in range(500):
+        position, vector = random_ray(24)
+        expected = _brute_force_raycast(model, position, vector, 24)
+        for model.hierarchy in (hierarchy, None):
+            block, _previous, _face = model.raycast(position, vector, 24)
+            assert block == expected, (position, vector, block, expected)
+    for _ in range(500):
+        low, high = random_box(rng.choice((2, 8, 24)))
+        expected = any(model.get_block(position) is not None for position in iter_box((low, high)))
+        for model.hierarchy in (hierarchy, None):
+            block = model.find_block(low, high)
+            assert (block is not None) == expected, (low, high, block)
+            if block is not None:
+                assert all(a <= v <= b for a, v, b in zip(low, block, high))
+                assert model.get_block(block) is not None
+    print("raycast and find_block match brute force on 500 rays and 500 boxes")
+
+    def measure(function, queries, repeat=3):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for query in queries:
+                function(*query)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best / len(queries) * 1e6
+
+    # Never, always, and with the default thresholds
+    modes = [(None, 0, 0), (hierarchy, 0, 0), (hierarchy, default_min_ray, default_min_box)]
+    print("%-20s %14s %14s %14s" % ("query (us)", "no hierarchy", "hierarchy", "default"))
+    for length in (8, 32, 64, 128, 192, 256):
+        rays = [random_ray(length) + (length,) for _ in range(300)]
+        times = []
+        for model.hierarchy, model.hierarchy_min_ray, model.hierarchy_min_box in modes:
+            times.append(measure(model.raycast, rays))
+        print("%-20s %14.1f %14.1f %14.1f" % ("ray of %d blocks" % length, *times))
+    for size in (8, 16, 32, 64, 128, 256):
+        boxes = [random_box(size) for _ in range(300)]
+        times = []
+        for model.hierarchy, model.hierarchy_min_ray, model.hierarchy_min_box in modes:
+            times.append(measure(model.find_block, boxes))
+        print("%-20s %14.1f %14.1f %14.1f" % ("box of %d blocks" % size, *times))
@@ -0,0 +1,196 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import concurrent.futures
+import os
+import struct
+import time
+
+from .blocks import BLOCKS, BLOCK_IDS
+from .utilities import *
+
+
+JOURNAL_MAGIC = b'TCJL'
+"""First bytes of a journal file"""
+
+JOURNAL_VERSION = 1
+"""Version of the layout of the journal files written by this module"""
+
+JOURNAL_HEADER = struct.Struct('<4sHQQ')
+"""Magic, version, identifier of the journal and identifier of the previous
+journal (0 if there is none)."""
+
+JOURNAL_RECORD = struct.Struct('<iiiBBI')
+"""Position of the block, identifier of the previous block, identifier of the
+new block and tick of the edit."""
+
+UNKNOWN_BLOCK = 255
+"""Identifier of the previous block when it was not known: the edit was made
+while its sector was not loaded."""
+
+
+def new_journal_id():
+    """Returns a random identifier for a new journal."""
+    return int.from_bytes(os.urandom(8), 'little') or 1
+
+
+def read_journal(path):
+    """Read a journal file.
+
+    Returns its identifier, the identifier of the previous journal and the list
+    of the edits as (position, block) tuples, where block is None for a removed
+    block. A record truncated by a crash is ignored.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < JOURNAL_HEADER.size:
+        raise ValueError("Truncated journal file")
+    magic, version, journal_id, previous_id = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC:
+        raise ValueError("Not a journal file")
+    if version != JOURNAL_VERSION:
+        raise ValueError("Unsupported journal file version %d" % version)
+    start = JOURNAL_HEADER.size
+    end = start + (len(data) - start) // JOURNAL_RECORD.size * JOURNAL_RECORD.size
+    edits = []
+    for x, y, z, _old, new, _tick in JOURNAL_RECORD.iter_unpack(data[start:end]):
+        block = BLOCKS[new] if new < len(BLOCKS) else None
+        edits.append(((x, y, z), block))
+    return journal_id, previous_id, edits
+
+
+class EditJournal:
+    """Append-only file of the edits of the world made since the last save.
+
+    Each edit is a small fixed size record. The records are buffered by the
+    main thread and written by another thread at most every `flush_interval`
+    seconds, so an edit costs nearly nothing, and a crash loses at most the
+    last interval. Loading a save replays the journals chained from it.
+    """
+
+    def __init__(self, path, journal_id, previous_id=0, flush_interval=JOURNAL_FLUSH_INTERVAL):
+        self.path = path
+        """Location of the file"""
+
+        self.id = journal_id
+        """Identifier of this journal, stored by the save it follows"""
+
+        self.previous_id = previous_id
+        """Identifier of the journal which was replaced by this one"""
+
+        self.flush_interval = flush_interval
+        """Maximum duration (in seconds) between two writes of the file"""
+
+        self.tick = 0
+        """Current tick of the game, stored with the edits"""
+
+        self.count = 0
+        """Number of edits recorded by this journal"""
+
+        self._buffer = []
+        """Records not yet written"""
+
+        self._last_flush = time.perf_counter()
+        """Time of the last write request"""
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        """Thread writing the file, in the order of the requests"""
+
+        self._file = None
+        """The opened file, only used by the thread of `executor`"""
+
+        self._closing = None
+        """Future of the closing of the file, once `close` was called"""
+
+        header = JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, journal_id, previous_id)
+        self.executor.submit(self._open, header)
+
+    def _open(self, header):
+        self._file = open(self.path, 'wb')
+        self._write(header)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, position, old_block, new_block):
+        """Record an edit. Blocks are None for air, `UNKNOWN_BLOCK` is used
+        for an unknown previous block."""
+        x, y, z = position
+        old_id = old_block if old_block == UNKNOWN_BLOCK else BLOCK_IDS[old_block]
+        self._buffer.append(JOURNAL_RECORD.pack(x, y, z, old_id, BLOCK_IDS[new_block], self.tick))
+        self.count += 1
+
+    def update(self):
+        """Advance the tick, and write the buffered records if it is time to.
+
+        It have to be called once per frame by the main thread."""
+        self.tick += 1
+        now = time.perf_counter()
+        if self._buffer and now - self._last_flush >= self.flush_interval:
+            self.flush()
+            self._last_flush = now
+
+    def flush(self):
+        """Write the buffered records in the background."""
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self.executor.submit(self._write, data)
+
+    def close(self, wait=False):
+        """Write the remaining records, and close the file.
+
+        The file is closed by the thread of `executor` once the records are
+        written. The main thread only waits for it if `wait` is True.
+        """
+        self.flush()
+        self._closing = self.executor.submit(self._close)
+        self.executor.shutdown(wait=wait)
+
+    @property
+    def closed(self):
+        """True once `close` was called and the file is actually closed."""
+        return self._closing is not None and self._closing.done()
+
+    def join(self):
+        """Wait until the file is closed, after `close` was called."""
+        self.executor.shutdown(wait=True)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
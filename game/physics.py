@@ -0,0 +1,343 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import itertools
+import math
+
+from .blocks import FACES
+from .utilities import *
+
+
+EPSILON = 1e-6
+"""Tolerance used to consider that a box touches a block without overlapping it."""
+
+PLAYER_HALF_WIDTH = 0.25
+"""Half of the width (in x and z) of the bodies. With this, a body stays 0.25 block
+away from the walls."""
+
+MAX_PUSH_OUT = 8
+"""Maximum number of times a buried body is pushed up, looking for free space."""
+
+
+def get_body_box(position, height):
+    """ Returns the bounding box of a body of `height` blocks, whose eyes are
+    at `position`.
+
+    The body is centered on `position` in x and z. The top of the head is 0.25
+    block above the eyes, and the feet are `height - 0.75` blocks below.
+    """
+    x, y, z = position
+    w = PLAYER_HALF_WIDTH
+    return [x - w, y - height + 0.75, z - w], [x + w, y + 0.25, z + w]
+
+
+def _block_range(low, high):
+    """ Returns the range of blocks overlapping the interval `low..high`.
+
+    Blocks are centered on integer locations, so the block `k` covers
+    `k - 0.5..k + 0.5`. Blocks only touched at the ends are excluded.
+    """
+    return range(math.floor(low - 0.5 + EPSILON) + 1, math.ceil(high + 0.5 - EPSILON))
+
+
+def _sweep_axis(model, box_min, box_max, axis, distance):
+    """ Move a box along a single axis until it touches a block.
+
+    The box is updated in place. Returns True if a block was hit.
+    """
+    if distance == 0:
+        return False
+    other1, other2 = (axis + 1) % 3, (axis + 2) % 3
+    range1 = _block_range(box_min[other1], box_max[other1])
+    range2 = _block_range(box_min[other2], box_max[other2])
+
+    if distance > 0:
+        # Layers of blocks in front of the box, from the closest one
+        start = box_max[axis]
+        layers = range(math.ceil(start + 0.5 - EPSILON), math.ceil(start + distance + 0.5))
+    else:
+        start = box_min[axis]
+        layers = range(math.floor(start - 0.5 + EPSILON), math.floor(start + distance - 0.5), -1)
+
+    pos = [0, 0, 0]
+    for layer in layers:
+        pos[axis] = layer
+        for a in range1:
+            pos[other1] = a
+            for b in range2:
+                pos[other2] = b
+                if model.empty(tuple(pos), must_be_loaded=True):
+                    continue
+                # Time of impact: stop against this layer of blocks
+                if distance > 0:
+                    moved = layer - 0.5 - start
+                else:
+                    moved = layer + 0.5 - start
+                box_min[axis] += moved
+                box_max[axis] += moved
+                return True
+
+    box_min[axis] += distance
+    box_max[axis] += distance
+    return False
+
+
+def sweep_box(model, box_min, box_max, displacement):
+    """ Move an axis aligned box through the blocks of a model, and stop it
+    against the blocks on its way.
+
+    The motion is resolved one axis after the other (y first, then x and z),
+    each axis in a single pass over the layers of blocks crossed by the box. The
+    box can't tunnel through blocks, whatever its speed. Large motions are split
+    into steps of 1 block, so that moving along a diagonal does not cut the
+    corners.
+
+    Blocks which are not yet loaded are considered as solid.
+
+    Parameters
+    ----------
+    model : Model
+        The world to collide with.
+    box_min, box_max : list of len 3
+        The bounding box, updated in place.
+    displacement : tuple of len 3
+        The (dx, dy, dz) motion of the box.
+
+    Returns
+    -------
+    hits : list of len 3
+        For each axis, -1 or 1 if the box was stopped in this direction, else 0.
+
+    """
+    hits = [0, 0, 0]
+    steps = max(1, math.ceil(max(abs(d) for d in displacement)))
+    for _ in range(steps):
+        for axis in (1, 0, 2):
+            if hits[axis]:
+                # Already stopped on this axis
+                continue
+            distance = displacement[axis] / steps
+            if _sweep_axis(model, box_min, box_max, axis, distance):
+                hits[axis] = 1 if distance > 0 else -1
+    return hits
+
+
+def _overlapping_blocks(model, box_min, box_max):
+    """ Returns the positions of the blocks overlapping a box. The blocks which
+    are not yet loaded are ignored."""
+    ranges = [_block_range(box_min[axis], box_max[axis]) for axis in range(3)]
+    return [pos for pos in itertools.product(*ranges) if not model.empty(pos)]
+
+
+def push_out_box(model, box_min, box_max):
+    """ Move a box out of the blocks it already overlaps, for example a block
+    placed inside it, or a sector loaded around it. `sweep_box` only stops a box
+    against the blocks in front of it, so it would stay stuck or fall through them.
+
+    The box is moved along a single axis, by the shortest distance clearing
+    all the overlapped blocks to a location overlapping no block. Upward wins
+    ties. If there is no such location, the box is pushed up and the search is
+    done again, at most `MAX_PUSH_OUT` times.
+
+    The box is updated in place. Returns the hits like `sweep_box`: -1 or 1
+    for the axis of the push, in the direction of the blocks pushing the box.
+    """
+    hits = [0, 0, 0]
+    blocks = _overlapping_blocks(model, box_min, box_max)
+    for _ in range(MAX_PUSH_OUT):
+        if not blocks:
+            break
+        # Pushes clearing the overlapped blocks, as (distance, axis, sign)
+        pushes = []
+        for axis in (1, 0, 2):
+            pushes.append((max(pos[axis] + 0.5 for pos in blocks) - box_min[axis], axis, 1))
+            pushes.append((box_max[axis] - min(pos[axis] - 0.5 for pos in blocks), axis, -1))
+        upward = pushes[0]
+        # A stable sort keeps upward first among the pushes of the same distance
+        pushes.sort(key=lambda push: push[0])
+        for distance, axis, sign in pushes:
+            moved_min, moved_max = list(box_min), list(box_max)
+            moved_min[axis] += distance * sign
+            moved_max[axis] += distance * sign
+            blocks = _overlapping_blocks(model, moved_min, moved_max)
+            if not blocks:
+                break
+        else:
+            # Buried, try again from above
+            distance, axis, sign = upward
+            moved_min, moved_max = list(box_min), list(box_max)
+            moved_min[1] += distance
+            moved_max[1] += distance
+            blocks = _overlapping_blocks(model, moved_min, moved_max)
+        box_min[:], box_max[:] = moved_min, moved_max
+        hits[axis] = -sign
+    return hits
+
+
+def move_body(model, position, displacement, height):
+    """ Move a body of `height` blocks, whose eyes are at `position`.
+
+    The body is first pushed out of the blocks it overlaps, see `push_out_box`.
+
+    Returns
+    -------
+    position : tuple of len 3
+        The new position of the eyes, taking into account collisions.
+    hits : list of len 3
+        For each axis, -1 or 1 if the body was stopped in this direction, else 0.
+
+    """
+    box_min, box_max = get_body_box(position, height)
+    pushed = push_out_box(model, box_min, box_max)
+    hits = sweep_box(model, box_min, box_max, displacement)
+    hits = [hit or push for hit, push in zip(hits, pushed)]
+    x = (box_min[0] + box_max[0]) / 2
+    y = box_max[1] - 0.25
+    z = (box_min[2] + box_max[2]) / 2
+    return (x, y, z), hits
+
+
+def _collide_substeps(model, position, height):
+    """ The resolver used before `sweep_box`, kept for the benchmark: push the
+    player out of the blocks overlapping its target `position`.
+
+    Returns the new position, and True if the player hit the ground or the
+    ceiling.
+    """
+    pad = 0.25
+    p = list(position)
+    np = normalize(position)
+    vertical_hit = False
+    for face in FACES:
+        for i in range(3):
+            if not face[i]:
+                continue
+            d = (p[i] - np[i]) * face[i]
+            if d < pad:
+                continue
+            for dy in range(height):
+                op = list(np)
+                op[1] -= dy
+                op[i] += face[i]
+                if model.empty(tuple(op), must_be_loaded=True):
+                    continue
+                p[i] -= (d - pad) * face[i]
+                if i == 1:
+                    vertical_hit = True
+                break
+    return tuple(p), vertical_hit
+
+
+def simulate_body(model, position, walk, ticks, substeps=None):
+    """ Simulate a walking body falling with the gravity, during `ticks` ticks.
+
+    With `substeps`, each tick is split into as many steps resolved by the
+    previous resolver, else each tick is a single call to `move_body`.
+
+    Returns the final position.
+    """
+    dt = 1.0 / TICKS_PER_SEC
+    dy = 0
+    for _ in range(ticks):
+        if substeps:
+            step = dt / substeps
+            for _ in range(substeps):
+                dy = max(dy - step * GRAVITY, -TERMINAL_VELOCITY)
+                target = tuple(p + d * step for p, d in zip(position, (walk[0], dy, walk[2])))
+                position, vertical_hit = _collide_substeps(model, target, PLAYER_HEIGHT)
+                if vertical_hit:
+                    dy = 0
+        else:
+            dy = max(dy - dt * GRAVITY, -TERMINAL_VELOCITY)
+            displacement = walk[0] * dt, dy * dt, walk[2] * dt
+            position, hits = move_body(model, position, displacement, PLAYER_HEIGHT)
+            if hits[1]:
+                dy = 0
+    return position
+
+
+if __name__ == '__main__':
+    # Tests and benchmark on a generated world: python -m game.physics
+    import time
+
+    import pyglet
+    pyglet.options['shadow_window'] = False
+
+    from .blocks import STONE
+    from .genworld import WorldGenerator
+    from .world import Model
+
+    generator = WorldGenerator(seed=0)
+    model = Model(None, None)
+    for x in range(-4, 4):
+        for y in range(-2, 6):
+            for z in range(-4, 4):
+                model.register_sector(generator.generate((x, y, z)))
+    model.focus_on((0, 0, 0))
+
+    # Bodies overlapping blocks are pushed out of them
+    ground = next(y for y in range(40, -16, -1) if not model.empty((0, y, 0)))
+    standing = (0, ground + 0.5 + PLAYER_HEIGHT - 0.75, 0)
+    position, hits = move_body(model, standing, (0, -0.01, 0), PLAYER_HEIGHT)
+    assert position == standing and hits[1] == -1, (position, hits)
+    sunk = (0, standing[1] - 0.6, 0)
+    position, hits = move_body(model, sunk, (0, -0.01, 0), PLAYER_HEIGHT)
+    assert position == standing and hits[1] == -1, (position, hits)
+    for placed in ((0, ground + 1, 0), (0, ground + 2, 0)):
+        model.add_block(placed, STONE)
+        position, _hits = move_body(model, standing, (0, -0.01, 0), PLAYER_HEIGHT)
+        box_min, box_max = get_body_box(position, PLAYER_HEIGHT)
+        assert not _overlapping_blocks(model, box_min, box_max), (placed, position)
+        model.remove_block(placed)
+    buried = (0, ground - 3, 0)
+    position, hits = move_body(model, buried, (0, -0.01, 0), PLAYER_HEIGHT)
+    box_min, box_max = get_body_box(position, PLAYER_HEIGHT)
+    assert not _overlapping_blocks(model, box_min, box_max), position
+    print("bodies overlapping blocks are pushed out")
+
+    ticks = 300
+    scenarios = [
+        ("standing", (0, 12, 0), (0, 0, 0)),
+        ("walking", (0, 12, 0), (WALKING_SPEED, 0, WALKING_SPEED / 2)),
+        ("falling", (0, 40, 0), (0, 0, 0)),
+    ]
+    print("%d ticks per scenario" % ticks)
+    print("%-10s %-12s %14s  %s" % ("scenario", "resolver", "us per tick", "final position"))
+    for name, start, walk in scenarios:
+        for resolver, substeps in (("8 substeps", 8), ("swept box", None)):
+            begin = time.perf_counter()
+            position = simulate_body(model, start, walk, ticks, substeps)
+            elapsed = time.perf_counter() - begin
+            print("%-10s %-12s %14.1f  (%.2f, %.2f, %.2f)" % (
+                name, resolver, elapsed / ticks * 1e6, *position))
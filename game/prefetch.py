@@ -0,0 +1,178 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import math
+
+from .utilities import *
+
+
+class SectorPrefetcher:
+    """Request sectors ahead of the player, along its predicted path.
+
+    The sectors displayed around the player are only requested once the player
+    enters a new sector, and only when one of their neighbors is already loaded.
+    A fast player can then outrun the generator. The prefetcher extrapolates the
+    motion of the player over `horizon` seconds and requests the sectors around
+    this path before they have to be displayed.
+    """
+
+    def __init__(self, model, horizon=PREFETCH_HORIZON, max_requests=PREFETCH_MAX_REQUESTS):
+        self.model = model
+
+        self.horizon = horizon
+        """Duration (in seconds) of the predicted path"""
+
+        self.max_requests = max_requests
+        """Maximum number of sectors requested by a single update"""
+
+        self.prefetched = set({})
+        """Sectors requested by the prefetcher and not yet displayed"""
+
+        self.hits = 0
+        """Number of displayed sectors which were already loaded thanks to the
+        prefetcher"""
+
+        self.late = 0
+        """Number of displayed sectors which were prefetched but not yet loaded.
+        A too short horizon increases this value."""
+
+        self.wasted = 0
+        """Number of prefetched sectors left behind without being displayed.
+        A too long horizon increases this value."""
+
+    @property
+    def hit_rate(self):
+        """Ratio of the prefetched sectors which were already loaded when they
+        were displayed."""
+        total = self.hits + self.late
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def update(self, position, velocity, sight):
+        """Request the sectors along the predicted path of the player.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the player.
+        velocity : tuple of len 3
+            The velocity of the player, in block per second.
+        sight : tuple of len 3
+            The normalized line of sight vector.
+        """
+        vx, vy, vz = velocity
+        speed = math.sqrt(vx * vx + vy * vy + vz * vz)
+        if speed == 0:
+            return
+        dx, dy, dz = vx / speed, vy / speed, vz / speed
+        x, y, z = position
+
+        # Sectors which will enter the view range during the horizon
+        view = int(FOG_END)
+        distance = min(speed * self.horizon, PREFETCH_MAX_DISTANCE)
+        length = view + distance
+
+        # The shown sectors are only requested if they can be seen from the
+        # camera (see `Model.update_reachable`). The ones further away are not
+        # searched yet.
+        model = self.model
+        shown = model.shown_sectors if model.frustum is not None else ()
+
+        candidates = {}
+        d = 0.0
+        while d <= length:
+            center = sectorize((x + dx * d, y + dy * d, z + dz * d))
+            for sector_pos in self._iter_corridor(center):
+                if sector_pos in candidates:
+                    continue
+                if sector_pos in model.sectors:
+                    continue
+                if sector_pos in model.requested:
+                    continue
+                if sector_pos in shown and sector_pos not in model.reachable:
+                    continue
+                candidates[sector_pos] = self._priority(position, sector_pos, sight)
+            d += SECTOR_SIZE
+
+        requests = sorted(candidates.items(), key=lambda item: item[1])
+        for sector_pos, priority in requests[:self.max_requests]:
+            if model.request_sector(sector_pos, priority):
+                self.prefetched.add(sector_pos)
+
+        # Forget the prefetched sectors left behind
+        limit = (length + view) / SECTOR_SIZE
+        sx, sy, sz = sectorize(position)
+        for sector_pos in list(self.prefetched):
+            px, py, pz = sector_pos
+            if abs(px - sx) + abs(py - sy) + abs(pz - sz) > limit:
+                self.prefetched.discard(sector_pos)
+                self.wasted += 1
+
+    def _iter_corridor(self, center):
+        """Iterate the sector `center` and its horizontal neighbors"""
+        x, y, z = center
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                yield x + dx, y, z + dz
+
+    def _priority(self, position, sector_pos, sight):
+        """Returns the priority of a prefetched sector.
+
+        The priority is between 1 and 2. It grows with the distance to the
+        player, which is divided by up to 2 for the sectors in the line of sight.
+        Prefetched sectors are computed after the displayed sectors inside the
+        frustum, and before the other ones (see `Model.sector_priority`).
+        """
+        half = SECTOR_SIZE / 2
+        cx = sector_pos[0] * SECTOR_SIZE + half - position[0]
+        cy = sector_pos[1] * SECTOR_SIZE + half - position[1]
+        cz = sector_pos[2] * SECTOR_SIZE + half - position[2]
+        distance = math.sqrt(cx * cx + cy * cy + cz * cz)
+        if distance == 0:
+            return 1.0
+        alignment = (cx * sight[0] + cy * sight[1] + cz * sight[2]) / distance
+        distance /= 1.5 + 0.5 * alignment
+        return 1.0 + distance / (distance + FOG_END)
+
+    def record_shown(self, sector_positions):
+        """Update the hit rate with sectors about to be displayed."""
+        sectors = self.model.sectors
+        for sector_pos in sector_positions:
+            if sector_pos in self.prefetched:
+                self.prefetched.discard(sector_pos)
+                if sector_pos in sectors:
+                    self.hits += 1
+                else:
+                    self.late += 1
@@ -0,0 +1,266 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import mmap
+import os
+import struct
+
+from .blocks import BLOCKS, BLOCK_IDS
+from .compression import CODECS, get_codec
+from .utilities import *
+
+
+REGION_MAGIC = b'TCRG'
+"""First bytes of a region file"""
+
+REGION_VERSION = 4
+"""Version of the layout of the region files written by this module"""
+
+HEADER = struct.Struct('<4sHHBdddddHII')
+"""Magic, version, size of the sectors, codec of the sectors, position (x, y, z) and rotation (x, y)
+of the player, number of block names, number of sectors and size of the
+metadata. The metadata (JSON) follows the header."""
+
+TABLE_ENTRY = struct.Struct('<QiiiII')
+"""Morton key and position of a sector, then offset and size of its record in
+the file. The entries are sorted by Morton key."""
+
+TABLE_KEY = struct.Struct('<Q')
+
+
+def write_region(path, sectors, position=(0, 0, 0), rotation=(0, 0), metadata=None,
+                 base=None, progress=None, codec=None):
+    """Write a region file.
+
+    The file is written directly at `path`. To replace a save, write it to a
+    temporary file and rename it once complete, so an existing save is never
+    left half written.
+
+    :param path: Location of the file
+    :param sectors: dict from sector position to `Sector.get_block_ids()`
+    :param position: Position of the player
+    :param rotation: Rotation of the player
+    :param metadata: Optional dict stored as JSON, like the parameters of the
+                     generator
+    :param base: Optional `RegionFile`. Its sectors which are not part of
+                 `sectors` are copied into the new file.
+    :param progress: Optional callable called with the number of sectors
+                     already written and the total number of sectors
+    :param codec: `Codec` of the sectors, `SAVE_CODEC` by default
+    """
+    if codec is None:
+        codec = get_codec(SAVE_CODEC)
+    names = [block.name.encode('utf-8') for block in BLOCKS[1:]]
+    positions = set(sectors)
+    if base is not None:
+        positions.update(base)
+    # Close sectors are stored close to each other in the file
+    positions = sorted(positions, key=morton_key)
+    total = len(positions)
+
+    metadata = json.dumps(metadata or {}).encode('utf-8')
+    header = HEADER.pack(REGION_MAGIC, REGION_VERSION, SECTOR_SIZE, codec.id,
+                         position[0], position[1], position[2],
+                         rotation[0], rotation[1], len(names), total,
+                         len(metadata))
+    header += metadata
+    name_table = b''.join(bytes((len(name),)) + name for name in names)
+
+    records = []
+    for index, sector_pos in enumerate(positions):
+        data = sectors.get(sector_pos)
+        if data is not None:
+            records.append(codec.encode(data))
+        elif base.same_blocks and base.codec is codec:
+            records.append(base.read_record(sector_pos))
+        else:
+            records.append(codec.encode(base.read_block_ids(sector_pos)))
+        if progress is not None:
+            progress(index + 1, total)
+
+    offset = len(header) + len(name_table) + TABLE_ENTRY.size * total
+    table = []
+    for sector_pos, record in zip(positions, records):
+        table.append(TABLE_ENTRY.pack(morton_key(sector_pos),
+                                      sector_pos[0], sector_pos[1], sector_pos[2],
+                                      offset, len(record)))
+        offset += len(record)
+
+    with open(path, 'wb') as file:
+        file.write(header)
+        file.write(name_table)
+        file.write(b''.join(table))
+        file.write(b''.join(records))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class RegionFile:
+    """Read access to a region file written by `write_region`.
+
+    The file is mapped in memory, and only its header is read when it is
+    opened. A sector is searched in the table and decoded when it is requested
+    by its position, so opening a save does not depend on its size.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        """The opened file"""
+
+        self.data = None
+        """Read only memory map of the file"""
+
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_header(self):
+        data = self.data
+        if len(data) < HEADER.size:
+            raise ValueError("Truncated region file")
+        (magic, version, sector_size, codec_id, x, y, z,
+         rx, ry, name_count, sector_count, metadata_size) = HEADER.unpack_from(data)
+        if magic != REGION_MAGIC:
+            raise ValueError("Not a region file")
+        if version != REGION_VERSION:
+            raise ValueError("Unsupported region file version %d" % version)
+        if sector_size != SECTOR_SIZE:
+            raise ValueError("Region file saved with sectors of size %d" % sector_size)
+        if codec_id not in CODECS:
+            raise ValueError("Unsupported sector codec %d" % codec_id)
+
+        self.codec = CODECS[codec_id]
+        """`Codec` of the sectors of this file"""
+
+        self.position = x, y, z
+        """Position of the player when the file was saved"""
+
+        self.rotation = rx, ry
+        """Rotation of the player when the file was saved"""
+
+        offset = HEADER.size + metadata_size
+        self.metadata = json.loads(data[HEADER.size:offset].decode('utf-8'))
+        """Dict of the metadata of the save"""
+
+        # Blocks are stored by name, so the identifiers can change between
+        # versions of the game. Unknown blocks are loaded as air.
+        self.translation = bytearray(256)
+        """Conversion table from the block identifiers of the file to `BLOCK_IDS`"""
+        ids = {block.name: block_id for block, block_id in BLOCK_IDS.items() if block is not None}
+        self.same_blocks = name_count == len(BLOCKS) - 1
+        """True if the file uses the same block identifiers as this game, so
+        its records can be copied as they are"""
+        for file_id in range(1, name_count + 1):
+            size = data[offset]
+            name = data[offset + 1:offset + 1 + size].decode('utf-8')
+            self.translation[file_id] = ids.get(name, 0)
+            if self.translation[file_id] != file_id:
+                self.same_blocks = False
+            offset += 1 + size
+
+        self.table_offset = offset
+        """Location of the table of the sectors in the file"""
+
+        self.sector_count = sector_count
+        """Number of sectors stored in the file"""
+
+        self._entries = {}
+        """Cache of the sectors already searched in the table. Mapping from
+        sector position to the offset and size of its record, or None if it is
+        not part of the file."""
+
+    def _find(self, sector_pos):
+        """Returns the offset and size of the record of a sector, or None."""
+        try:
+            return self._entries[sector_pos]
+        except KeyError:
+            pass
+        # Binary search on the Morton keys
+        key = morton_key(sector_pos)
+        data = self.data
+        table_offset = self.table_offset
+        entry_size = TABLE_ENTRY.size
+        low, high = 0, self.sector_count
+        while low < high:
+            middle = (low + high) // 2
+            if TABLE_KEY.unpack_from(data, table_offset + middle * entry_size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entry = None
+        if low < self.sector_count:
+            found, x, y, z, offset, size = TABLE_ENTRY.unpack_from(data, table_offset + low * entry_size)
+            if found == key:
+                entry = offset, size
+        self._entries[sector_pos] = entry
+        return entry
+
+    def __contains__(self, sector_pos):
+        return self._find(sector_pos) is not None
+
+    def __len__(self):
+        return self.sector_count
+
+    def __iter__(self):
+        """Iterate over the positions of the stored sectors."""
+        start = self.table_offset
+        end = start + TABLE_ENTRY.size * self.sector_count
+        for _, x, y, z, _, _ in TABLE_ENTRY.iter_unpack(self.data[start:end]):
+            yield x, y, z
+
+    def read_record(self, sector_pos):
+        """Returns the record of a stored sector as it is in the file, or None
+        if the sector is not part of the file."""
+        entry = self._find(sector_pos)
+        if entry is None:
+            return None
+        offset, size = entry
+        return self.data[offset:offset + size]
+
+    def read_block_ids(self, sector_pos):
+        """Returns the block identifiers of a stored sector, like
+        `Sector.get_block_ids`, or None if the sector is not part of the file."""
+        record = self.read_record(sector_pos)
+        if record is None:
+            return None
+        return self.codec.decode(record).translate(self.translation)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
@@ -31,13 +31,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import concurrent.futures
 import pyglet
-import pickle
 import json
 import os
 
 from time import gmtime, strftime
 
+from .config import JOURNAL_COMPACTION_EDITS
+from .journal import EditJournal, new_journal_id, read_journal
+from .region import RegionFile, write_region
+from .streaming import SectorStreamer
+
 
 class SaveManager(object):
     def __init__(self):
@@ -52,9 +57,36 @@ class SaveManager(object):
         # Get the appropriate OS specific save path:
         self.save_path = pyglet.resource.get_settings_path('TerraCraft')
         self.save_file = 'saveworld{}.dat'
+        self.journal_file = 'saveworld{}-{:016x}.journal'
         self.config_file = 'config.json'
         self.save_slot = 0
 
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        """Thread writing the saves, so the game is not interrupted"""
+
+        self._saving = None
+        """Description of the save being written, None if there is none"""
+
+        self.save_progress = None
+        """Ratio of the sectors of the save being written which are already
+        encoded, None if no save is being written"""
+
+        self.journal = None
+        """`EditJournal` recording the edits made since the last save"""
+
+        self.replayed_edits = 0
+        """Number of edits of the journals replayed by the last `load_world`"""
+
+        self._closing_journals = []
+        """Previous journals which can still be written by their thread"""
+
+        self._obsolete_journals = set({})
+        """Paths of the journals folded into a completed save, not yet removed"""
+
+        self.last_journal_id = 0
+        """Identifier of the last journal replayed by `load_world`, or of the
+        journal of the loaded save. The next journal follows it."""
+
         self._data = {'revision': 0,
                       'options': {},
                       'inventory': {}}
@@ -69,27 +101,141 @@ class SaveManager(object):
         return os.path.exists(os.path.join(self.save_path, save_file))
 
     def load_world(self, model):
+        """Attach the save to the model, as the source of the saved sectors.
+
+        The file is mapped in memory and only its header is read here. The
+        sectors are searched when the model shows or requests them, and
+        decoded by a `SectorStreamer`, nearest first.
+        The position of the player is available from `model.loader`.
+
+        The edits recorded by the journals since this save are replayed. They
+        are applied to the sectors when they are loaded.
+        """
         save_file = self.save_file.format(self.save_slot)
         save_file_path = os.path.join(self.save_path, save_file)
         self.timestamp_print('start loading...')
 
         try:
-            with open(save_file_path, 'rb') as file:
-                loaded_world = pickle.load(file)
-
-            for position, block in loaded_world.items():
-                if block.name == "dirt_with_grass":
-                    model.add_block(position, block, immediate=True)
-                else:
-                    model.add_block(position, block, immediate=False)
-
-            self.timestamp_print('Loading completed.')
-            return True
-        except:     # If loading fails for ANY reason, return False
+            region = RegionFile(save_file_path)
+        except Exception:     # If loading fails for ANY reason, return False
             self.timestamp_print('Loading failed! Generating a new map.')
+            self.last_journal_id = 0
+            if os.path.exists(save_file_path):
+                # The new map will be saved at the same location
+                self._backup_unreadable_save(save_file_path)
+            return False
+
+        if model.loader is not None:
+            model.loader.close()
+        model.loader = region
+        model.streamer = SectorStreamer(region)
+        self.replayed_edits, self.last_journal_id = self._replay_journals(
+            model, region.metadata.get('journal', 0))
+        self.timestamp_print('Loading completed: {} sectors, {} edits replayed.'.format(
+            len(region), self.replayed_edits))
+        return True
+
+    def _backup_unreadable_save(self, save_file_path):
+        """Rename a save which can't be loaded and its journals, so they are
+        not replaced by the save of a new map."""
+        suffix = strftime('.unreadable-%Y%m%d-%H%M%S', gmtime())
+        paths = [save_file_path] + list(self._get_journal_paths().values())
+        for path in paths:
+            try:
+                os.replace(path, path + suffix)
+            except OSError as e:
+                self.timestamp_print('backup of {} failed: {}'.format(path, e))
+                continue
+            self.timestamp_print('unreadable save kept as: {}'.format(path + suffix))
+
+    def _get_journal_paths(self):
+        """Returns a mapping from journal identifier to the path of the journal
+        files of the current save slot."""
+        prefix, suffix = self.journal_file.split('{:016x}')
+        prefix = prefix.format(self.save_slot)
+        paths = {}
+        if not os.path.exists(self.save_path):
+            return paths
+        for name in os.listdir(self.save_path):
+            if name.startswith(prefix) and name.endswith(suffix):
+                try:
+                    journal_id = int(name[len(prefix):-len(suffix)], 16)
+                except ValueError:
+                    continue
+                paths[journal_id] = os.path.join(self.save_path, name)
+        return paths
+
+    def _replay_journals(self, model, journal_id):
+        """Apply the edits of the journal `journal_id`, then of the journals
+        following it. Returns the number of edits and the identifier of the
+        last journal of the chain."""
+        journals = {}
+        for path in self._get_journal_paths().values():
+            try:
+                found_id, previous_id, edits = read_journal(path)
+            except (OSError, ValueError):
+                continue
+            journals[found_id] = previous_id, edits
+
+        edits = []
+        seen = set({})
+        last_id = journal_id
+        while journal_id and journal_id not in seen:
+            seen.add(journal_id)
+            last_id = journal_id
+            if journal_id in journals:
+                edits.extend(journals[journal_id][1])
+            following = [found_id for found_id, (previous_id, _) in journals.items()
+                         if previous_id == journal_id]
+            journal_id = following[0] if following else None
+        model.apply(edits)
+        return len(edits), last_id
+
+    def start_journal(self, model, position=(0, 0, 0), rotation=(0, 0)):
+        """Start to record the edits of the player.
+
+        If the loaded save is up to date, the journal simply follows the
+        journal of the save. Else the world is saved first, which starts a
+        new journal. In both cases the new journal follows the last journal
+        replayed, so the edits survive a crash before the save is written.
+        """
+        region = model.loader
+        if region is None or self.replayed_edits or not region.metadata.get('journal'):
+            self.save_world(model, position, rotation)
+            return
+        self._start_new_journal(model, new_journal_id())
+
+    def _start_new_journal(self, model, journal_id):
+        """Replace the journal of the model by a new one, which follows the
+        current journal, or the last journal replayed by `load_world`."""
+        if self.journal is not None:
+            previous_id = self.journal.id
+            self.journal.close()
+            self._closing_journals.append(self.journal)
+        else:
+            previous_id = self.last_journal_id
+        path = os.path.join(self.save_path, self.journal_file.format(self.save_slot, journal_id))
+        self.journal = EditJournal(path, journal_id, previous_id)
+        model.journal = self.journal
+
+    def needs_compaction(self):
+        """Returns True if the journal is long enough to be folded into a
+        new save."""
+        return (self.journal is not None and self._saving is None
+                and self.journal.count >= JOURNAL_COMPACTION_EDITS)
+
+    def save_world(self, model, position=(0, 0, 0), rotation=(0, 0)):
+        """Save the world in the background.
+
+        The content to save is snapshotted immediately, then it is encoded and
+        written by another thread into a temporary file. The file replaces the
+        save in `update`, once it is complete. Returns False if a save is
+        already in progress.
+        """
+        if self._saving is not None:
+            self.timestamp_print('a save is already in progress')
             return False
 
-    def save_world(self, model):
         save_file = self.save_file.format(self.save_slot)
         save_file_path = os.path.join(self.save_path, save_file)
         self.timestamp_print('start saving...')
@@ -98,13 +244,128 @@ class SaveManager(object):
         if not os.path.exists(self.save_path):
             self.timestamp_print(
                 'creating directory: {}'.format(self.save_path))
-            os.mkdir(self.save_path)
+            os.makedirs(self.save_path)
+
+        # Only the edited sectors are stored, the others are generated again
+        # from the parameters of the generator. Further edits do not change
+        # this snapshot.
+        sectors = model.get_saved_sectors()
+        metadata = {}
+        if model.generator is not None:
+            metadata['generator'] = model.generator.get_parameters()
+
+        # The edits made from now are recorded by a new journal, replayed on
+        # top of this save. The previous journal is kept until the save is
+        # written, it is replayed before the new one until then.
+        journal_id = new_journal_id()
+        metadata['journal'] = journal_id
+        self._start_new_journal(model, journal_id)
+
+        temp_path = save_file_path + '.tmp'
+        self.save_progress = 0.0
+        future = self.executor.submit(self._write_save, temp_path, sectors, position, rotation,
+                                      metadata, model.loader)
+        self._saving = future, model, temp_path, save_file_path
+        return True
+
+    def _write_save(self, path, sectors, position, rotation, metadata, base):
+        """Compute the saved sectors and write them, from the thread of the
+        executor."""
+        write_region(path, sectors.build(), position, rotation, metadata, base,
+                     self._on_save_progress)
+
+    def _on_save_progress(self, done, total):
+        """Called by the thread writing the save."""
+        self.save_progress = done / total
+
+    def is_saving(self):
+        """Returns True if a save is being written."""
+        return self._saving is not None
 
-        # Efficiently save the world to a binary file
-        with open(save_file_path, 'wb') as file:
-            pickle.dump(model.world, file)
+    def update(self):
+        """Write the journal, and complete the save being written if it is ready.
+
+        It have to be called regularly by the main thread.
+        """
+        if self.journal is not None:
+            self.journal.update()
+        if self._obsolete_journals:
+            self._remove_obsolete_journals()
+        if self._saving is None:
+            return
+        future, model, temp_path, save_file_path = self._saving
+        if not future.done():
+            return
+        self._saving = None
+        self.save_progress = None
+
+        try:
+            future.result()
+        except Exception as e:
+            self.timestamp_print('saving failed: {}'.format(e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        # The mapping of the previous save have to be released before it is
+        # replaced. The sectors which were not read yet are in the new file.
+        loader = model.loader
+        if loader is not None:
+            loader.close()
+        os.replace(temp_path, save_file_path)
+        if loader is not None:
+            model.loader = RegionFile(save_file_path)
+            if model.streamer is None:
+                model.streamer = SectorStreamer(model.loader)
+            else:
+                # The requests in flight are read from the new file
+                model.streamer.region = model.loader
+
+        # The journals before this save are not needed anymore
+        for journal_id, path in self._get_journal_paths().items():
+            if self.journal is None or journal_id != self.journal.id:
+                self._obsolete_journals.add(path)
+        self._remove_obsolete_journals()
+
+        self.timestamp_print('saving completed.')
+
+    def _remove_obsolete_journals(self):
+        """Remove the journals folded into the last save.
+
+        A journal still opened by its thread can't be removed on every
+        platform, so it is kept until a next call, like a file which could
+        not be removed.
+        """
+        self._closing_journals = [journal for journal in self._closing_journals
+                                  if not journal.closed]
+        opened = {journal.path for journal in self._closing_journals}
+        for path in list(self._obsolete_journals):
+            if path in opened:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Retried by the next call
+                continue
+            self._obsolete_journals.discard(path)
 
-        self.timestamp_print('saving completed')
+    def close(self):
+        """Complete the save being written and write the journal, before the
+        game exits."""
+        if self._saving is not None:
+            self.timestamp_print('waiting for the save...')
+            concurrent.futures.wait([self._saving[0]])
+            self.update()
+        if self.journal is not None:
+            self.journal.close(wait=True)
+            self.journal = None
+        for journal in self._closing_journals:
+            journal.join()
+        if self._obsolete_journals:
+            self._remove_obsolete_journals()
+        self.executor.shutdown()
 
     def __getitem__(self, item):
         return self._data.get(item)
@@ -43,9 +43,12 @@ from pyglet.graphics import OrderedGroup
 
 from .blocks import *
 from .utilities import *
-from .graphics import BlockGroup
+from .graphics import BlockGroup, Frustum
 from .genworld import WorldGenerator
-from .world import Model
+from .physics import move_body
+from .prefetch import SectorPrefetcher
+from .schematic import Schematic
+from .world import Model, SPAWN_PRIORITY
 
 
 class AudioEngine:
@@ -195,6 +198,10 @@ class GameScene(Scene):
         # A Batch is a collection of vertex lists for batched rendering.
         self.batch = pyglet.graphics.Batch()
 
+        # Vertex lists of the sectors. This batch is not drawn at once, only
+        # the sectors inside the frustum are drawn.
+        self.world_batch = pyglet.graphics.Batch()
+
         # pyglet Groups manages setting/unsetting OpenGL state.
         self.block_group = BlockGroup(
             self.window, pyglet.resource.texture('textures.png'), order=0)
@@ -255,8 +262,17 @@ class GameScene(Scene):
         self.num_keys = [key._1, key._2, key._3, key._4, key._5,
                          key._6, key._7, key._8, key._9, key._0]
 
+        # The first corner of the region to copy, marked with the B key.
+        self.copy_mark = None
+
+        # The last copied region, pasted with the V key.
+        self.clipboard = None
+
         # Instance of the model that handles the world.
-        self.model = Model(batch=self.batch, group=self.block_group)
+        self.model = Model(batch=self.world_batch, group=self.block_group)
+
+        # Request the sectors along the path of the player before they are shown.
+        self.prefetcher = SectorPrefetcher(self.model)
 
         # The crosshairs at the center of the screen.
         self.reticle = self.batch.add(4, GL_LINES, self.hud_group, 'v2i', ('c3B', [0]*12))
@@ -271,9 +287,16 @@ class GameScene(Scene):
                                             x=10, y=self.window.height - 10, anchor_x='left',
                                             anchor_y='top', color=(0, 0, 0, 255))
 
+        # The values displayed by the label, to detect when it has to be updated.
+        self.info_values = None
+
         # Boolean whether to display loading screen.
         self.initialized = False
 
+        # Sectors around the spawn location which are not yet loaded
+        self.spawn_sectors = []
+        self._spawn_sector_count = 0
+
         # Some environmental SFX to preload:
         self.jump_sfx = pyglet.resource.media('jump.wav', streaming=False)
         self.destroy_sfx = pyglet.resource.media('dirt.wav', streaming=False)
@@ -305,6 +328,13 @@ class GameScene(Scene):
         dz = math.sin(math.radians(x - 90)) * m
         return dx, dy, dz
 
+    def get_frustum(self):
+        """ Returns the volume of the world actually seen by the player.
+
+        """
+        width, height = self.window.get_size()
+        return Frustum(self.position, self.rotation, width / float(height))
+
     def get_motion_vector(self):
         """ Returns the current motion vector indicating the velocity of the
         player.
@@ -348,30 +378,62 @@ class GameScene(Scene):
             dz = 0.0
         return dx, dy, dz
 
+    def get_speed(self):
+        """ Returns the actual speed of the player, in block per second.
+
+        """
+        if self.flying:
+            return FLYING_SPEED
+        if self.running:
+            return RUNNING_SPEED
+        return WALKING_SPEED
+
     def init_player_on_summit(self):
-        """Make sure the sector containing the actor is loaded and the player is on top of it.
+        """Place the player on top of the ground, and request the sectors around
+        before any other one (see `request_spawn_area`).
+
+        The height of the ground is computed by the generator without generating
+        the sectors, so the first frame is not delayed.
         """
         generator = self.model.generator
         x, y, z = self.position
-        free_height = 0
-        limit = 100
-        while free_height < PLAYER_HEIGHT and limit:
-            pos = x , y, z
-            sector_position = sectorize(pos)
-            if sector_position not in self.model.sectors:
-                sector = generator.generate(sector_position)
-                self.model.register_sector(sector)
-            if self.model.empty(pos):
-                free_height += 1
-            else:
-                free_height = 0
-            y = y + 1
-            limit -= 1
+        height = generator.surface_height(int(round(x)), int(round(z)))
+        if height is not None:
+            y = height + PLAYER_HEIGHT
 
-        position = x, y - PLAYER_HEIGHT + 1, z
+        position = x, y, z
         if self.position != position:
             self.position = position
             self.frustum_updated = True
+        self.request_spawn_area()
+
+    def request_spawn_area(self):
+        """Request the sector of the player before any other one, then the
+        sectors around."""
+        spawn = sectorize(self.position)
+        self.spawn_sectors = []
+        if self.model.request_sector(spawn, SPAWN_PRIORITY):
+            self.spawn_sectors.append(spawn)
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                for dz in range(-1, 2):
+                    sector_pos = spawn[0] + dx, spawn[1] + dy, spawn[2] + dz
+                    if sector_pos == spawn:
+                        continue
+                    if self.model.request_sector(sector_pos, SPAWN_PRIORITY + 0.5):
+                        self.spawn_sectors.append(sector_pos)
+        self._spawn_sector_count = len(self.spawn_sectors)
+
+    def get_loading_progress(self):
+        """Returns the ratio of the sectors around the spawn location which are
+        loaded, or None once they are all loaded."""
+        if not self.spawn_sectors:
+            return None
+        sectors = self.model.sectors
+        self.spawn_sectors = [pos for pos in self.spawn_sectors if pos not in sectors]
+        if not self.spawn_sectors:
+            return None
+        return 1 - len(self.spawn_sectors) / self._spawn_sector_count
 
     def update(self, dt):
         """ This method is scheduled to be called repeatedly by the pyglet
@@ -391,16 +453,43 @@ class GameScene(Scene):
                 # Returns False if unable to load the save
                 has_save = self.scene_manager.save.load_world(self.model)
 
-            if not has_save:
-                generator = WorldGenerator()
-                generator.y = self.position[1]
-                generator.hills_enabled = HILLS_ON
-                self.model.generator = generator
+            # The sectors which were not edited are not part of the save, they
+            # are generated again
+            generator = WorldGenerator()
+            generator.y = self.position[1]
+            generator.hills_enabled = HILLS_ON
+            generator.caves_enabled = CAVES_ON
+            if has_save:
+                # Same world as the one which was saved
+                generator.set_parameters(self.model.loader.metadata.get('generator', {}))
+            self.model.generator = generator
+
+            if has_save:
+                # The saved sectors are streamed from the save, nearest first
+                self.position = self.model.loader.position
+                self.rotation = self.model.loader.rotation
+                self.frustum_updated = True
+                self.request_spawn_area()
+            else:
                 self.init_player_on_summit()
 
+            # Record the edits from now, so they survive a crash
+            self.scene_manager.save.start_journal(self.model, self.position, self.rotation)
+
             self.initialized = True
 
         self.model.process_queue()
+        save = self.scene_manager.save
+        save.update()
+        if save.needs_compaction():
+            # Fold the journal into a new save
+            save.save_world(self.model, self.position, self.rotation)
+
+        if self.model.generator is not None:
+            speed = self.get_speed()
+            dx, dy, dz = self.get_motion_vector()
+            velocity = dx * speed, dy * speed, dz * speed
+            self.prefetcher.update(self.position, velocity, self.get_sight_vector())
 
         if self.frustum_updated:
             sector = sectorize(self.position)
@@ -408,10 +497,11 @@ class GameScene(Scene):
             self.sector = sector
             self.frustum_updated = False
 
-        m = 8
+        # Cache the blocks around the player for the physics
+        self.model.focus_on(self.position)
+
         dt = min(dt, 0.2)
-        for _ in range(m):
-            self._update(dt / m)
+        self._update(dt)
 
     def _update(self, dt):
         """ Private implementation of the `update()` method. This is where most
@@ -424,7 +514,7 @@ class GameScene(Scene):
 
         """
         # walking
-        speed = FLYING_SPEED if self.flying else RUNNING_SPEED if self.running else WALKING_SPEED
+        speed = self.get_speed()
         d = dt * speed  # distance covered this tick.
         dx, dy, dz = self.get_motion_vector()
         # New position in space, before accounting for gravity.
@@ -438,22 +528,23 @@ class GameScene(Scene):
             self.dy = max(self.dy, -TERMINAL_VELOCITY)
             dy += self.dy * dt
         # collisions
-        x, y, z = self.position
-        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
+        x, y, z = self.collide(self.position, (dx, dy, dz), PLAYER_HEIGHT)
 
         position = (x, y, z)
         if self.position != position:
             self.position = position
             self.frustum_updated = True
 
-    def collide(self, position, height):
-        """ Checks to see if the player at the given `position` and `height`
-        is colliding with any blocks in the world.
+    def collide(self, position, displacement, height):
+        """ Move the player from `position` according to a `displacement`, and
+        stop it against the blocks in the world.
 
         Parameters
         ----------
         position : tuple of len 3
-            The (x, y, z) position to check for collisions at.
+            The (x, y, z) position of the player before the motion.
+        displacement : tuple of len 3
+            The (dx, dy, dz) motion of the player.
         height : int or float
             The height of the player.
 
@@ -463,33 +554,12 @@ class GameScene(Scene):
             The new position of the player taking into account collisions.
 
         """
-        # How much overlap with a dimension of a surrounding block you need to
-        # have to count as a collision. If 0, touching terrain at all counts as
-        # a collision. If .49, you sink into the ground, as if walking through
-        # tall DIRT_WITH_GRASS. If >= .5, you'll fall through the ground.
-        pad = 0.25
+        position, hits = move_body(self.model, position, displacement, height)
+        if hits[1]:
+            # You are colliding with the ground or ceiling, so stop
+            # falling / rising.
+            self.dy = 0
         p = list(position)
-        np = normalize(position)
-        for face in FACES:  # check all surrounding blocks
-            for i in range(3):  # check each dimension independently
-                if not face[i]:
-                    continue
-                # How much overlap you have with this dimension.
-                d = (p[i] - np[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in range(height):  # check each height
-                    op = list(np)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if self.model.empty(tuple(op), must_be_loaded=True):
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    if face == (0, -1, 0) or face == (0, 1, 0):
-                        # You are colliding with the ground or ceiling, so stop
-                        # falling / rising.
-                        self.dy = 0
-                    break
 
         generator = self.model.generator
         if generator is None:
@@ -517,31 +587,43 @@ class GameScene(Scene):
         A sector is a contiguous x, y sub-region of world. Sectors are
         used to speed up world rendering.
         """
+        self.model.frustum = self.get_frustum()
         sector = sectorize(position)
         if self.sector == sector:
             # The following computation is based on the actual sector
             # So if there is no changes on the sector, it have to display
-            # The exact same thing
+            # The exact same thing. Only the sectors to load first can change.
+            self.model.update_requested_priorities()
             return
 
         sectors_to_show = []
+        sectors_to_keep = []
         pad = int(FOG_END) // SECTOR_SIZE
+        show_radius = pad + pad // 2
+        hide_radius = show_radius + HIDE_MARGIN
+        pad += HIDE_MARGIN
         for dx in range(-pad, pad + 1):
             for dy in range(-pad, pad + 1):
                 for dz in range(-pad, pad + 1):
                     # Manathan distance
                     dist = abs(dx) + abs(dy) + abs(dz)
-                    if dist > pad + pad // 2:
+                    if dist > hide_radius:
                         # Skip sectors outside of the sphere of radius pad+1
                         continue
                     x, y, z = sector
+                    sectors_to_keep.append((x + dx, y + dy, z + dz))
+                    if dist > show_radius:
+                        # Not yet shown, but not hidden if already shown
+                        continue
                     sectors_to_show.append((dist, x + dx, y + dy, z + dz))
 
         # Sort by distance to the player in order to
         # displayed closest sectors first
         sectors_to_show = sorted(sectors_to_show)
         sectors_to_show = [s[1:] for s in sectors_to_show]
-        self.model.show_only_sectors(sectors_to_show)
+        shown_sectors = self.model.shown_sectors
+        self.prefetcher.record_shown([s for s in sectors_to_show if s not in shown_sectors])
+        self.model.show_only_sectors(sectors_to_show, sectors_to_keep)
 
     def on_mouse_press(self, x, y, button, modifiers):
         """Event handler for the Window.on_mouse_press event.
@@ -577,6 +659,30 @@ class GameScene(Scene):
         else:
             self.set_exclusive_mouse(True)
 
+    def edit_clipboard(self, symbol):
+        """Copy and paste a region of the world.
+
+        B marks the block in sight as the first corner of the region, C copies
+        the region up to the block in sight, and V pastes the copied region
+        against the block in sight.
+        """
+        vector = self.get_sight_vector()
+        block, previous = self.model.hit_test(self.position, vector)
+        if symbol == key.B:
+            if block:
+                self.copy_mark = block
+        elif symbol == key.C:
+            if block and self.copy_mark:
+                box = self.copy_mark, block
+                volume = 1
+                for axis in range(3):
+                    volume *= abs(box[0][axis] - box[1][axis]) + 1
+                if volume <= CLIPBOARD_MAX_VOLUME:
+                    self.clipboard = Schematic.copy(self.model, box)
+        elif symbol == key.V:
+            if previous and self.clipboard:
+                self.clipboard.paste(self.model, previous)
+
     def on_mouse_motion(self, x, y, dx, dy):
         """Event handler for the Window.on_mouse_motion event.
 
@@ -650,8 +756,10 @@ class GameScene(Scene):
             self.toggleGui = not self.toggleGui
         elif symbol == key.F3:
             self.toggleLabel = not self.toggleLabel
+        elif symbol in (key.B, key.C, key.V):
+            self.edit_clipboard(symbol)
         elif symbol == key.F5:
-            self.scene_manager.save.save_world(self.model)
+            self.scene_manager.save.save_world(self.model, self.position, self.rotation)
         elif symbol == key.F12:
             pyglet.image.get_buffer_manager().get_color_buffer().save('screenshot.png')
         elif symbol in self.num_keys:
@@ -711,6 +819,11 @@ class GameScene(Scene):
         # Set the current position/rotation before drawing
         self.block_group.position = self.position
         self.block_group.rotation = self.rotation
+        # Draw the sectors inside the frustum
+        self.model.frustum = self.get_frustum()
+        self.block_group.set_state()
+        self.model.draw()
+        self.block_group.unset_state()
         # Draw everything in the batch
         self.batch.draw()
 
@@ -741,14 +854,31 @@ class GameScene(Scene):
     def draw_label(self):
         """ Draw the label in the top left of the screen.
 
+        The text is only rebuilt when one of the displayed values changed.
         """
         x, y, z = self.position
-        elements = []
-        elements.append("FPS = [%02d]" % pyglet.clock.get_fps())
-        elements.append("COORDS = [%.2f, %.2f, %.2f]" % (x, y, z))
-        elements.append("SECTORS = %d [+%d]" % (len(self.model.sectors), len(self.model.requested)))
-        elements.append("BLOCKS = %d" % self.model.count_blocks())
-        self.info_label.text = ' : '.join(elements)
+        stats = self.model.stats
+        values = (int(pyglet.clock.get_fps()), round(x, 2), round(y, 2), round(z, 2),
+                  stats.loaded_sectors, stats.requested_sectors,
+                  self.model.drawn_sectors, stats.shown_sectors,
+                  stats.blocks, stats.visible_faces, stats.vertex_memory // (1024 * 1024),
+                  int(self.prefetcher.hit_rate * 100))
+        loading_progress = self.get_loading_progress()
+        if loading_progress is not None:
+            values += (int(loading_progress * 100),)
+        save_progress = self.scene_manager.save.save_progress
+        if save_progress is not None:
+            values += (int(save_progress * 100),)
+        if values != self.info_values:
+            self.info_values = values
+            text = ("FPS = [%02d] : COORDS = [%.2f, %.2f, %.2f] : "
+                    "SECTORS = %d [+%d] : DRAWN = %d/%d : BLOCKS = %d : "
+                    "FACES = %d : VRAM = %d MB : PREFETCH = %d%%")
+            if loading_progress is not None:
+                text += " : LOADING = %d%%"
+            if save_progress is not None:
+                text += " : SAVING = %d%%"
+            self.info_label.text = text % values
         self.info_label.draw()
 
 
@@ -762,6 +892,8 @@ class HelpScene(Scene):
                              "* Left click mouse to destroy block",
                              "* Right click mouse to create block",
                              "* Press keys 1 through 0 to choose block type",
+                             "* Press B then C to copy the region between 2 blocks",
+                             "* Press V to paste the copied region",
                              "* Press F2 key to hide block selection",
                              "* Press F3 key to hide debug stats"]
 
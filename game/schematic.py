@@ -0,0 +1,181 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from .utilities import *
+
+
+class Schematic:
+    """A compact structure of blocks, which can be stamped into the world.
+
+    The blocks are stored in a dense array of indexes into a `palette`. The
+    index 0 is the air: it is never written, so a stamped structure does not
+    carve the blocks around it.
+
+    The `origin` is the location of the anchor of the structure inside the
+    array. Stamping the schematic at a position places its origin there, for
+    example the bottom of the trunk of a tree.
+    """
+
+    def __init__(self, size, origin=(0, 0, 0), palette=None, data=None):
+        self.size = tuple(size)
+        """Size (x, y, z) of the structure, in blocks"""
+
+        self.origin = tuple(origin)
+        """Location of the anchor inside the structure"""
+
+        self.palette = [None] if palette is None else list(palette)
+        """List of the blocks used by the structure. The first one is the air."""
+
+        sx, sy, sz = self.size
+        self.data = bytearray(sx * sy * sz) if data is None else bytearray(data)
+        """Index of the block in the palette for each location, with the z
+        coordinate varying the fastest"""
+
+        self._palette_index = {block: i for i, block in enumerate(self.palette)}
+
+    @staticmethod
+    def from_blocks(blocks):
+        """Create a schematic from a mapping from position to block.
+
+        The positions are relative to the anchor of the structure.
+        """
+        if not blocks:
+            return Schematic((0, 0, 0))
+        low = [min(position[axis] for position in blocks) for axis in range(3)]
+        high = [max(position[axis] for position in blocks) for axis in range(3)]
+        size = [high[axis] - low[axis] + 1 for axis in range(3)]
+        schematic = Schematic(size, origin=[-v for v in low])
+        for (x, y, z), block in blocks.items():
+            schematic.set((x - low[0], y - low[1], z - low[2]), block)
+        return schematic
+
+    @staticmethod
+    def copy(model, box):
+        """Copy the blocks of the `model` inside a box.
+
+        The box is given by 2 opposite corners, both included. The anchor of the
+        schematic is its lowest corner. The blocks of unloaded sectors are
+        copied as air.
+        """
+        low = [min(box[0][axis], box[1][axis]) for axis in range(3)]
+        high = [max(box[0][axis], box[1][axis]) for axis in range(3)]
+        schematic = Schematic([high[axis] - low[axis] + 1 for axis in range(3)])
+        sector_low = sectorize(low)
+        sector_high = sectorize(high)
+        for sx in range(sector_low[0], sector_high[0] + 1):
+            for sy in range(sector_low[1], sector_high[1] + 1):
+                for sz in range(sector_low[2], sector_high[2] + 1):
+                    sector = model.sectors.get((sx, sy, sz))
+                    if sector is None or not sector.blocks:
+                        continue
+                    xmin, ymin, zmin = sector.min_block
+                    xmax, ymax, zmax = sector.max_block
+                    blocks = sector.blocks
+                    for x in range(max(xmin, low[0]), min(xmax, high[0] + 1)):
+                        for y in range(max(ymin, low[1]), min(ymax, high[1] + 1)):
+                            for z in range(max(zmin, low[2]), min(zmax, high[2] + 1)):
+                                block = blocks.get((x, y, z))
+                                if block is not None:
+                                    schematic.set((x - low[0], y - low[1], z - low[2]), block)
+        return schematic
+
+    @property
+    def volume(self):
+        """Number of locations of the structure, air included"""
+        sx, sy, sz = self.size
+        return sx * sy * sz
+
+    def _index(self, location):
+        x, y, z = location
+        _, sy, sz = self.size
+        return (x * sy + y) * sz + z
+
+    def set(self, location, block):
+        """Set the block at a location of the structure, relative to its lowest
+        corner."""
+        index = self._palette_index.get(block)
+        if index is None:
+            index = len(self.palette)
+            self.palette.append(block)
+            self._palette_index[block] = index
+        self.data[self._index(location)] = index
+
+    def get(self, location):
+        """Return the block at a location of the structure, relative to its
+        lowest corner."""
+        return self.palette[self.data[self._index(location)]]
+
+    def iter_blocks(self, position, min_block=None, max_block=None):
+        """Iterate the (position, block) of the structure stamped at `position`.
+
+        Only the positions between `min_block` (included) and `max_block`
+        (excluded) are iterated, which allows to clip the structure to a sector
+        without walking over all its blocks.
+        """
+        sx, sy, sz = self.size
+        ox = position[0] - self.origin[0]
+        oy = position[1] - self.origin[1]
+        oz = position[2] - self.origin[2]
+        x0, y0, z0 = 0, 0, 0
+        x1, y1, z1 = sx, sy, sz
+        if min_block is not None:
+            x0, y0, z0 = max(x0, min_block[0] - ox), max(y0, min_block[1] - oy), max(z0, min_block[2] - oz)
+        if max_block is not None:
+            x1, y1, z1 = min(x1, max_block[0] - ox), min(y1, max_block[1] - oy), min(z1, max_block[2] - oz)
+        data = self.data
+        palette = self.palette
+        for x in range(x0, x1):
+            for y in range(y0, y1):
+                index = (x * sy + y) * sz
+                for z in range(z0, z1):
+                    value = data[index + z]
+                    if value:
+                        yield (ox + x, oy + y, oz + z), palette[value]
+
+    def stamp(self, sector, position):
+        """Write the structure stamped at `position` into a `Sector`.
+
+        The blocks outside of the sector are clipped. The visible blocks of the
+        sector are only updated once.
+        """
+        changes = dict(self.iter_blocks(position, sector.min_block, sector.max_block))
+        if changes:
+            sector.set_blocks(changes)
+
+    def paste(self, model, position):
+        """Write the structure stamped at `position` into a `Model`.
+
+        Each touched sector is rebuilt once.
+        """
+        model.apply(self.iter_blocks(position))
@@ -0,0 +1,166 @@
+#!/bin/python3
+
+"""
+ ________                                        ______                       ______     __
+|        \                                      /      \                     /      \   |  \
+ \$$$$$$$$______    ______    ______   ______  |  $$$$$$\  ______   ______  |  $$$$$$\ _| $$_
+   | $$  /      \  /      \  /      \ |      \ | $$   \$$ /      \ |      \ | $$_  \$$|   $$ \
+   | $$ |  $$$$$$\|  $$$$$$\|  $$$$$$\ \$$$$$$\| $$      |  $$$$$$\ \$$$$$$\| $$ \     \$$$$$$
+   | $$ | $$    $$| $$   \$$| $$   \$$/      $$| $$   __ | $$   \$$/      $$| $$$$      | $$ __
+   | $$ | $$$$$$$$| $$      | $$     |  $$$$$$$| $$__/  \| $$     |  $$$$$$$| $$        | $$|  \
+   | $$  \$$     \| $$      | $$      \$$    $$ \$$    $$| $$      \$$    $$| $$         \$$  $$
+    \$$   \$$$$$$$ \$$       \$$       \$$$$$$$  \$$$$$$  \$$       \$$$$$$$ \$$          \$$$$
+
+
+Copyright (C) 2013 Michael Fogleman
+Copyright (C) 2018/2019 Stefano Peris <xenonlab.develop@gmail.com>
+
+Github repository: <https://github.com/XenonLab-Studio/TerraCraft>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+from .world import Sector
+
+
+class SectorWorker:
+    """Compute sectors on another thread, by order of priority.
+
+    Subclasses implement `compute_sector`. The results are sent to a callback,
+    from the thread of the worker.
+    """
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        """This thread pool will execute one task at a time. Others are stacked,
+        waiting for execution."""
+
+        self.callback = None
+        """Callback for the result of the executor"""
+
+        self._pending = {}
+        """Mapping from requested sector position to its priority"""
+
+        self._pending_queue = []
+        """Heap of (priority, order, sector position) for the pending requests.
+        It can contain outdated entries, which are skipped."""
+
+        self._pending_order = itertools.count()
+        """Break the ties between requests of the same priority"""
+
+        self._in_flight = set()
+        """Requested sectors picked by the executor, which are computed or
+        waiting to be received by the model. Requesting them again does nothing
+        until `release_sector` is called."""
+
+        self._pending_lock = threading.Lock()
+
+    def set_callback(self, callback):
+        """Set a callback called when a new sector is computed"""
+        self.callback = callback
+
+    def request_sector(self, sector, priority=0):
+        """Compute the content of a sector asynchronously and return the result to a
+        callback already specified to this worker.
+
+        Pending requests with the smallest `priority` are computed first. Requesting
+        again a pending sector only updates its priority, and requesting again a
+        sector already picked does nothing.
+        """
+
+        def send_result(future):
+            chunk = future.result()
+            self.callback(chunk)
+
+        with self._pending_lock:
+            if sector in self._in_flight:
+                return
+            previous = self._pending.get(sector)
+            if previous is not None and previous <= priority:
+                return
+            self._pending[sector] = priority
+            heapq.heappush(self._pending_queue, (priority, next(self._pending_order), sector))
+            if previous is not None:
+                # Already submitted to the executor
+                return
+
+        future = self.executor.submit(self._compute_next)
+        future.add_done_callback(send_result)
+
+    def _compute_next(self):
+        """Compute the pending sector with the highest priority.
+
+        Each call of `request_sector` for a new sector submits exactly one call of
+        this function to the executor, so there is always a pending sector.
+        """
+        with self._pending_lock:
+            while True:
+                priority, _, sector = heapq.heappop(self._pending_queue)
+                if self._pending.get(sector) == priority:
+                    del self._pending[sector]
+                    self._in_flight.add(sector)
+                    break
+        return self.compute_sector(sector)
+
+    def release_sector(self, sector):
+        """Called by the model once a computed sector is received, so it can be
+        requested again later."""
+        with self._pending_lock:
+            self._in_flight.discard(sector)
+
+    def compute_sector(self, sector):
+        """Returns the `Sector` at the position `sector`."""
+        raise NotImplementedError
+
+
+class SectorStreamer(SectorWorker):
+    """Decode the sectors of a save on another thread, by order of priority.
+
+    The record of a sector is read from the region file by the main thread when
+    it is requested, so the worker never uses the file, which can be replaced
+    by a new save at any time.
+    """
+
+    def __init__(self, region):
+        super().__init__()
+
+        self.region = region
+        """`RegionFile` the sectors are read from"""
+
+        self._records = {}
+        """Mapping from requested sector position to its record and its codec
+        and translation table"""
+
+    def request_sector(self, sector, priority=0):
+        """Decode a sector of the save asynchronously and return the result to
+        the callback. See `SectorWorker.request_sector`."""
+        with self._pending_lock:
+            if sector not in self._in_flight and sector not in self._records:
+                region = self.region
+                self._records[sector] = region.read_record(sector), region.codec, region.translation
+        super().request_sector(sector, priority)
+
+    def compute_sector(self, sector):
+        record, codec, translation = self._records.pop(sector)
+        chunk = Sector.from_block_ids(sector, codec.decode(record).translate(translation))
+        # Let the main thread run between two sectors
+        time.sleep(0.001)
+        return chunk
@@ -31,16 +31,49 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import itertools
 import time
 
-from collections import deque
+from collections import deque, OrderedDict
 
 from pyglet.gl import *
 
 from .blocks import *
+from .compression import get_codec
+from .graphics import draw_vertex_lists
+from .hierarchy import OccupancyHierarchy
+from .journal import UNKNOWN_BLOCK
 from .utilities import *
 
 
+ALL_FACES_CONNECTED = (1 << (len(FACES) * len(FACES))) - 1
+"""Connectivity of a sector without blocks: every face is connected to every face."""
+
+EDIT_PRIORITY = -1
+"""Priority of the sectors requested because of an edit of the player. They are
+generated before the sectors requested by the display."""
+
+SPAWN_PRIORITY = -2
+"""Priority of the sectors around the spawn location of the player. They are
+generated before any other sector."""
+
+
+def opposite_face(face_index):
+    """Returns the index of the face opposite to `FACES[face_index]`"""
+    # FACES are stored by pairs of opposite faces
+    return face_index ^ 1
+
+
+def iter_box(box):
+    """Iterate all the positions of a box defined by 2 opposite corners, both
+    included."""
+    (x1, y1, z1), (x2, y2, z2) = box
+    for x in range(min(x1, x2), max(x1, x2) + 1):
+        for y in range(min(y1, y2), max(y1, y2) + 1):
+            for z in range(min(z1, z2), max(z1, z2) + 1):
+                yield x, y, z
+
+
 def iter_neighbors(position):
     """Iterate all the positions neighboring this position"""
     x, y, z = position
@@ -71,12 +104,178 @@ class Sector:
         self.position = position
         """Location of this sector."""
 
+        self.modified = False
+        """True if the blocks of this sector were edited since it was generated
+        or read from the save. An evicted sector is only kept in memory if it
+        is modified, else it is generated or read from the save again."""
+
+        self.connectivity = None
+        """Cached result of `get_connectivity`, None when it have to be computed."""
+
+        self._block_ids = None
+        """Cached result of `get_block_ids`, None when it have to be computed.
+        The bytes are never modified, so they can be used by another thread."""
+
+        self._bounds = None
+        """Smallest box [[xmin, ymin, zmin], [xmax, ymax, zmax]] (both included)
+        containing the blocks of this sector, None if there is no blocks."""
+
+        self._bounds_dirty = False
+        """True if `_bounds` could be too large and have to be computed again"""
+
+        self.neighbors = [None] * len(FACES)
+        """Loaded sectors sharing a face with this one, indexed like `FACES`.
+        None when the neighbor is not loaded. Maintained by the `Model`."""
+
         self.min_block = [i * SECTOR_SIZE for i in position]
         """Minimum location (included) of block in this section."""
 
         self.max_block = [(i + 1) * SECTOR_SIZE for i in position]
         """Maximum location (excluded) of block in this section."""
 
+    def get_block_ids(self):
+        """Returns the identifiers of the blocks of this sector, as bytes.
+
+        It is indexed by the location of the blocks inside the sector, with
+        `((dx * SECTOR_SIZE) + dy) * SECTOR_SIZE + dz`. Air is 0. The result is
+        cached until the next edit of the sector."""
+        if self._block_ids is not None:
+            return self._block_ids
+        data = bytearray(SECTOR_SIZE ** 3)
+        xmin, ymin, zmin = self.min_block
+        for (x, y, z), block in self.blocks.items():
+            index = ((x - xmin) * SECTOR_SIZE + (y - ymin)) * SECTOR_SIZE + (z - zmin)
+            data[index] = BLOCK_IDS[block]
+        self._block_ids = bytes(data)
+        return self._block_ids
+
+    @staticmethod
+    def from_block_ids(position, data):
+        """Create a sector at `position` from the result of `get_block_ids`."""
+        sector = Sector(position)
+        xmin, ymin, zmin = sector.min_block
+        blocks = {}
+        for index, block_id in enumerate(data):
+            if block_id == 0:
+                continue
+            xz, dz = divmod(index, SECTOR_SIZE)
+            dx, dy = divmod(xz, SECTOR_SIZE)
+            blocks[(xmin + dx, ymin + dy, zmin + dz)] = BLOCKS[block_id]
+        sector.set_blocks(blocks)
+        sector._block_ids = bytes(data)
+        return sector
+
+    def dump(self):
+        """Returns a compressed binary description of the blocks of this sector.
+
+        It is the result of `get_block_ids` encoded with the codec `SPILL_CODEC`."""
+        return get_codec(SPILL_CODEC).encode(self.get_block_ids())
+
+    @staticmethod
+    def load(position, data):
+        """Create a sector at `position` from the result of `dump`."""
+        return Sector.from_block_ids(position, get_codec(SPILL_CODEC).decode(data))
+
+    def get_connectivity(self):
+        """Returns which faces of this sector are connected together through the
+        empty space of this sector.
+
+        The result is a bit mask. The bit `i * 6 + j` is set if the faces `FACES[i]`
+        and `FACES[j]` are connected. The bit `i * 6 + i` is set if the face
+        `FACES[i]` touches the empty space at all.
+        """
+        if self.connectivity is None:
+            self.connectivity = self._compute_connectivity()
+        return self.connectivity
+
+    def is_connected(self, face_index1, face_index2):
+        """True if we can see the face `FACES[face_index2]` of this sector from the
+        face `FACES[face_index1]`."""
+        return (self.get_connectivity() >> (face_index1 * 6 + face_index2)) & 1 == 1
+
+    def get_faces_seen_from(self, position):
+        """Returns the faces of this sector which can be seen from a location
+        inside this sector, as bits of the `FACES` indexes."""
+        filled = self._get_filled_array()
+        xmin, ymin, zmin = self.min_block
+        x, y, z = normalize(position)
+        size = SECTOR_SIZE
+        start = ((x - xmin) * size + (y - ymin)) * size + (z - zmin)
+        if not 0 <= start < len(filled) or filled[start]:
+            # Inside a block, let's consider every faces
+            return (1 << len(FACES)) - 1
+        return self._flood_fill(filled, start)
+
+    def _get_filled_array(self):
+        """Returns an array of 1 for each location containing a block, indexed
+        like in `dump`."""
+        size = SECTOR_SIZE
+        xmin, ymin, zmin = self.min_block
+        filled = bytearray(size ** 3)
+        for x, y, z in self.blocks:
+            filled[((x - xmin) * size + (y - ymin)) * size + (z - zmin)] = 1
+        return filled
+
+    def _flood_fill(self, filled, start):
+        """Fill the empty area of the array `filled` containing the location
+        `start`. Returns the faces touched by this area, as bits of the `FACES`
+        indexes."""
+        size = SECTOR_SIZE
+        last = size - 1
+        filled[start] = 1
+        stack = [start]
+        faces = 0
+        while stack:
+            index = stack.pop()
+            xy, z = divmod(index, size)
+            x, y = divmod(xy, size)
+            neighbors = []
+            if y == last:
+                faces |= 1
+            else:
+                neighbors.append(index + size)
+            if y == 0:
+                faces |= 2
+            else:
+                neighbors.append(index - size)
+            if x == 0:
+                faces |= 4
+            else:
+                neighbors.append(index - size * size)
+            if x == last:
+                faces |= 8
+            else:
+                neighbors.append(index + size * size)
+            if z == last:
+                faces |= 16
+            else:
+                neighbors.append(index + 1)
+            if z == 0:
+                faces |= 32
+            else:
+                neighbors.append(index - 1)
+            for neighbor in neighbors:
+                if not filled[neighbor]:
+                    filled[neighbor] = 1
+                    stack.append(neighbor)
+        return faces
+
+    def _compute_connectivity(self):
+        """Flood fill the empty space of this sector and check which faces each
+        empty area touches."""
+        if not self.blocks:
+            return ALL_FACES_CONNECTED
+        filled = self._get_filled_array()
+        connectivity = 0
+        for start in range(len(filled)):
+            if filled[start]:
+                continue
+            faces = self._flood_fill(filled, start)
+            for i in range(6):
+                if faces & (1 << i):
+                    connectivity |= faces << (i * 6)
+        return connectivity
+
     def is_face_full(self, direction):
         """Check if one of the face of this section is full of blocks.
 
@@ -123,6 +322,9 @@ class Sector:
             return
 
         self.blocks[position] = block
+        self.connectivity = None
+        self._block_ids = None
+        self._summary_add(position)
         if self.exposed(position):
             self.visible.add(position)
         self.check_neighbors(position)
@@ -143,6 +345,97 @@ class Sector:
                 if self.check_face_full(face):
                     self.face_full_cache.add(face)
 
+    def set_blocks(self, changes):
+        """Add, replace or remove many blocks of this sector at once.
+
+        `changes` is a mapping from position to a block, or to None to remove
+        the block. Positions outside of this sector are ignored. The visible
+        blocks, the outline and the full faces are only updated once, at the end.
+
+        Returns the full faces discarded by the changes.
+        """
+        blocks = self.blocks
+        touched = []
+        for position, block in changes.items():
+            if not self.contains(position):
+                continue
+            if block is None:
+                if blocks.pop(position, None) is None:
+                    continue
+                self._summary_remove(position)
+            else:
+                blocks[position] = block
+                self._summary_add(position)
+            touched.append(position)
+        if not touched:
+            return set({})
+        self.connectivity = None
+        self._block_ids = None
+
+        # Changed blocks and their neighbors could be hidden or exposed
+        around = set(touched)
+        for position in touched:
+            for neighbor, _face in iter_neighbors(position):
+                around.add(neighbor)
+        for position in around:
+            if position in blocks and self.exposed(position):
+                self.visible.add(position)
+            else:
+                self.visible.discard(position)
+
+        for position in touched:
+            if position in blocks and self.on_outline(position):
+                self.outline.add(position)
+            else:
+                self.outline.discard(position)
+
+        previous = self.face_full_cache
+        self.face_full_cache = set(face for face in FACES if self.check_face_full(face))
+        return previous - self.face_full_cache
+
+    def get_bounds(self):
+        """Returns the smallest box [[xmin, ymin, zmin], [xmax, ymax, zmax]]
+        (both included) containing the blocks of this sector, or None if the
+        sector is empty."""
+        if self._bounds_dirty:
+            self._bounds_dirty = False
+            self._bounds = None
+            for position in self.blocks:
+                self._summary_add(position)
+        return self._bounds
+
+    def _summary_add(self, position):
+        """Update the summary after adding a block at `position`."""
+        x, y, z = position
+        if not self._bounds_dirty:
+            bounds = self._bounds
+            if bounds is None:
+                self._bounds = [[x, y, z], [x, y, z]]
+            else:
+                low, high = bounds
+                for axis in range(3):
+                    if position[axis] < low[axis]:
+                        low[axis] = position[axis]
+                    elif position[axis] > high[axis]:
+                        high[axis] = position[axis]
+
+    def _summary_remove(self, position):
+        """Update the summary after removing the block at `position`."""
+        if not self._bounds_dirty:
+            low, high = self._bounds
+            for axis in range(3):
+                if position[axis] == low[axis] or position[axis] == high[axis]:
+                    # The bounds could shrink
+                    self._bounds_dirty = True
+                    break
+
+    def on_outline(self, position):
+        """True if the `position` is on one of the faces of this sector."""
+        for axis in range(3):
+            if position[axis] == self.min_block[axis] or position[axis] == self.max_block[axis] - 1:
+                return True
+        return False
+
     def check_face_full(self, face):
         axis = (face[1] != 0) * 1 + (face[2] != 0) * 2
         if face[axis] == -1:
@@ -169,6 +462,9 @@ class Sector:
         Returns discarded full faces in case.
         """
         del self.blocks[position]
+        self.connectivity = None
+        self._block_ids = None
+        self._summary_remove(position)
         self.check_neighbors(position)
         self.visible.discard(position)
         self.outline.discard(position)
@@ -190,12 +486,60 @@ class Sector:
     def exposed(self, position):
         """ Returns False if given `position` is surrounded on all 6 sides by
         blocks, True otherwise.
+
+        The blocks outside of this sector are read from the loaded neighbors
+        (see `neighbors`). They are considered empty when the neighbor is not
+        loaded.
         """
-        for neighbor, _face in iter_neighbors(position):
-            if self.empty(neighbor):
-                return True
+        x, y, z = position
+        blocks = self.blocks
+        xmin, ymin, zmin = self.min_block
+        xmax, ymax, zmax = self.max_block
+        for i, (dx, dy, dz) in enumerate(FACES):
+            pos = (x + dx, y + dy, z + dz)
+            if xmin <= pos[0] < xmax and ymin <= pos[1] < ymax and zmin <= pos[2] < zmax:
+                if pos not in blocks:
+                    return True
+            else:
+                neighbor = self.neighbors[i]
+                if neighbor is None or pos not in neighbor.blocks:
+                    return True
         return False
 
+    def update_visible(self, position):
+        """Update the visibility of the block at `position`, after a change
+        of its surrounding. Returns True if it changed."""
+        if position in self.blocks and self.exposed(position):
+            if position in self.visible:
+                return False
+            self.visible.add(position)
+            return True
+        if position in self.visible:
+            self.visible.remove(position)
+            return True
+        return False
+
+    def update_border(self, face_index):
+        """Update the visibility of the blocks on the face `FACES[face_index]`,
+        after the neighbor sector behind it was linked or unlinked. Returns True
+        if one of them changed."""
+        face = FACES[face_index]
+        axis = (face[1] != 0) * 1 + (face[2] != 0) * 2
+        axis2 = (axis + 1) % 3
+        axis3 = (axis + 2) % 3
+        pos = [None] * 3
+        pos[axis] = self.min_block[axis] if face[axis] == -1 else self.max_block[axis] - 1
+        blocks = self.blocks
+        changed = False
+        for a2 in range(self.min_block[axis2], self.max_block[axis2]):
+            pos[axis2] = a2
+            for a3 in range(self.min_block[axis3], self.max_block[axis3]):
+                pos[axis3] = a3
+                position = tuple(pos)
+                if position in blocks and self.update_visible(position):
+                    changed = True
+        return changed
+
     def check_neighbors(self, position):
         """ Check all blocks surrounding `position` and ensure their visual
         state is current. This means hiding blocks that are not exposed and
@@ -213,6 +557,299 @@ class Sector:
                     self.visible.remove(neighbor)
 
 
+class OccupancyGrid:
+    """A dense cache of the blocks around the player.
+
+    Most of the queries of the physics and the line of sight are done close to
+    the player. This grid stores one byte per location of a cube of `size`
+    blocks, centered on the sector of the player, to answer them without looking
+    for the sector.
+    """
+
+    EMPTY = 0
+    BLOCK = 1
+    NOT_LOADED = 2
+
+    _FROM_BLOCK_IDS = bytes([EMPTY]) + bytes([BLOCK]) * 255
+    """Translation table from the block identifiers to the content of a location"""
+
+    def __init__(self, size=OCCUPANCY_GRID_SIZE):
+        assert size % SECTOR_SIZE == 0
+        self.size = size
+        """Size of the cube, in blocks. It is a multiple of SECTOR_SIZE."""
+
+        self.center = None
+        """Sector at the center of the grid, None if the grid is not yet used"""
+
+        self.origin = (0, 0, 0)
+        """Minimum location (included) of the cube"""
+
+        self.cells = bytearray(size ** 3)
+        """Content of each location, indexed by ((x * size) + y) * size + z"""
+
+        self._rows = [((dx * size + dy) * size, (dx * SECTOR_SIZE + dy) * SECTOR_SIZE)
+                      for dx in range(SECTOR_SIZE) for dy in range(SECTOR_SIZE)]
+        """Offsets of the rows of a sector in `cells` and in its block identifiers"""
+
+        self.hits = 0
+        """Number of queries answered by this grid"""
+
+        self.misses = 0
+        """Number of queries outside of this grid"""
+
+    def recenter(self, sectors, sector_pos):
+        """Move the grid around the sector `sector_pos` and fill it with the
+        loaded `sectors`.
+
+        The locations still inside the grid are moved, and only the sectors
+        which enter the grid are filled.
+        """
+        size = self.size
+        n = size // SECTOR_SIZE
+        half = n // 2
+        previous = self.center
+        self.center = sector_pos
+        self.origin = tuple((i - half) * SECTOR_SIZE for i in sector_pos)
+        if previous is not None:
+            shift = [a - b for a, b in zip(sector_pos, previous)]
+            if max(abs(d) for d in shift) >= n:
+                previous = None
+
+        if previous is None:
+            self.cells[:] = bytes([self.NOT_LOADED]) * len(self.cells)
+        else:
+            # Move the whole content at once. The locations which wrap around
+            # on an axis are part of the sectors entering the grid, which are
+            # written below.
+            sx, sy, sz = (d * SECTOR_SIZE for d in shift)
+            offset = (sx * size + sy) * size + sz
+            cells = self.cells
+            length = len(cells)
+            if offset > 0:
+                cells[:length - offset] = cells[offset:]
+            elif offset < 0:
+                cells[-offset:] = cells[:length + offset]
+
+        x0, y0, z0 = (i - half for i in sector_pos)
+        for dx in range(n):
+            for dy in range(n):
+                for dz in range(n):
+                    if previous is not None:
+                        # Position in the previous grid
+                        px, py, pz = dx + shift[0], dy + shift[1], dz + shift[2]
+                        if 0 <= px < n and 0 <= py < n and 0 <= pz < n:
+                            continue
+                    position = x0 + dx, y0 + dy, z0 + dz
+                    sector = sectors.get(position)
+                    if sector is not None:
+                        self.fill_sector(sector)
+                    elif previous is not None:
+                        self.clear_sector(position)
+
+    def _index(self, position):
+        """Returns the index of a location in `cells`, else None"""
+        size = self.size
+        ox, oy, oz = self.origin
+        x, y, z = position
+        x -= ox
+        y -= oy
+        z -= oz
+        if 0 <= x < size and 0 <= y < size and 0 <= z < size:
+            return (x * size + y) * size + z
+        return None
+
+    def get(self, position):
+        """Returns the content of a location, or None if it is outside the grid."""
+        if self.center is None:
+            return None
+        # Inlined version of `_index`, as it is called very often
+        size = self.size
+        ox, oy, oz = self.origin
+        x, y, z = position
+        x -= ox
+        y -= oy
+        z -= oz
+        if 0 <= x < size and 0 <= y < size and 0 <= z < size:
+            self.hits += 1
+            return self.cells[(x * size + y) * size + z]
+        self.misses += 1
+        return None
+
+    def set(self, position, value):
+        """Update the content of a location, if it is part of the grid."""
+        if self.center is None:
+            return
+        index = self._index(position)
+        if index is not None:
+            self.cells[index] = value
+
+    def fill_sector(self, sector):
+        """Update the locations of a loaded sector."""
+        if self.center is None:
+            return
+        index = self._index(sector.min_block)
+        if index is None:
+            return
+        data = memoryview(sector.get_block_ids().translate(self._FROM_BLOCK_IDS))
+        cells = self.cells
+        # Copy the sector row by row
+        for start, row in self._rows:
+            start += index
+            cells[start:start + SECTOR_SIZE] = data[row:row + SECTOR_SIZE]
+
+    def clear_sector(self, sector_pos, value=NOT_LOADED):
+        """Set every location of a sector to `value`."""
+        if self.center is None:
+            return
+        origin = [i * SECTOR_SIZE for i in sector_pos]
+        index = self._index(origin)
+        if index is None:
+            return
+        size = self.size
+        line = bytes([value]) * SECTOR_SIZE
+        for dx in range(SECTOR_SIZE):
+            for dy in range(SECTOR_SIZE):
+                start = index + (dx * size + dy) * size
+                self.cells[start:start + SECTOR_SIZE] = line
+
+
+class WorldStats:
+    """Running totals describing the content of a `Model`.
+
+    They are updated by the model on each change, so reading them does not
+    walk over the sectors.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+        self.blocks = 0
+        """Number of blocks of the loaded sectors"""
+
+        self.blocks_per_type = {}
+        """Number of blocks of the loaded sectors, by block"""
+
+        self.shown_vertices = 0
+        """Number of vertices of the meshes of the shown sectors"""
+
+    def add_block(self, block):
+        self.blocks += 1
+        self.blocks_per_type[block] = self.blocks_per_type.get(block, 0) + 1
+
+    def remove_block(self, block):
+        self.blocks -= 1
+        count = self.blocks_per_type[block] - 1
+        if count:
+            self.blocks_per_type[block] = count
+        else:
+            del self.blocks_per_type[block]
+
+    def add_sector(self, sector):
+        for block in sector.blocks.values():
+            self.add_block(block)
+
+    def remove_sector(self, sector):
+        for block in sector.blocks.values():
+            self.remove_block(block)
+
+    def add_mesh(self, vertex_list):
+        self.shown_vertices += vertex_list.get_size()
+
+    def remove_mesh(self, vertex_list):
+        self.shown_vertices -= vertex_list.get_size()
+
+    @property
+    def visible_faces(self):
+        """Number of faces of the meshes of the shown sectors"""
+        return self.shown_vertices // 4
+
+    @property
+    def vertex_memory(self):
+        """GPU memory (in bytes) used by the meshes, the cached ones included"""
+        return self.shown_vertices * 5 * 4 + self.model._mesh_cache_bytes
+
+    @property
+    def requested_sectors(self):
+        """Number of sectors requested and not yet received"""
+        return len(self.model.requested)
+
+    @property
+    def loaded_sectors(self):
+        """Number of sectors in memory"""
+        return len(self.model.sectors)
+
+    @property
+    def meshed_sectors(self):
+        """Number of shown sectors with a mesh"""
+        return len(self.model._shown)
+
+    @property
+    def shown_sectors(self):
+        """Number of sectors around the player, loaded or not"""
+        return len(self.model.shown_sectors)
+
+    @property
+    def spilled_sectors(self):
+        """Number of edited sectors evicted from memory"""
+        return len(self.model.spilled)
+
+
+class SavedSectors:
+    """Snapshot of the edited sectors of a `Model`, to be written in a save.
+
+    It only holds immutable data, and copies of the edits of the sectors which
+    are not loaded, so further changes of the model do not change it.
+    """
+
+    def __init__(self, loaded, spilled, edits, loader=None, generator=None):
+        self.loaded = loaded
+        """Mapping from position to the block identifiers of the modified
+        loaded sectors"""
+
+        self.spilled = spilled
+        """Mapping from position to the data of the spilled sectors"""
+
+        self.edits = edits
+        """Mapping from position to the pending edits of a sector not loaded"""
+
+        self.loader = loader
+        """`RegionFile` of the loaded save, or None"""
+
+        self.generator = generator
+        """`WorldGenerator` of the model, or None"""
+
+    def build(self):
+        """Returns the content to save.
+
+        Only the edited sectors are part of it, the others can be generated
+        again. It is a mapping from sector position to the block identifiers of
+        the sector (see `Sector.get_block_ids`), for the modified loaded
+        sectors, the spilled sectors and the sectors with pending edits. The
+        sectors of the loaded save which are not part of the result were not
+        changed, they have to be copied from `loader`.
+
+        The sectors with pending edits are read from the save or generated
+        again, so it takes a while. It can be called by another thread.
+        """
+        sectors = {}
+        codec = get_codec(SPILL_CODEC)
+        for sector_pos, data in self.spilled.items():
+            sectors[sector_pos] = codec.decode(data)
+        sectors.update(self.loaded)
+        for sector_pos, edits in self.edits.items():
+            if sector_pos in sectors:
+                sector = Sector.from_block_ids(sector_pos, sectors[sector_pos])
+            elif self.loader is not None and sector_pos in self.loader:
+                sector = Sector.from_block_ids(sector_pos, self.loader.read_block_ids(sector_pos))
+            elif self.generator is not None:
+                sector = self.generator.generate(sector_pos)
+            else:
+                continue
+            sector.set_blocks(edits)
+            sectors[sector_pos] = sector.get_block_ids()
+        return sectors
+
+
 class Model(object):
     def __init__(self, batch, group):
         self.batch = batch
@@ -228,22 +865,101 @@ class Model(object):
         # Mapping from position to a pyglet `VertextList` for all shown sections.
         self._shown = {}
 
+        # Shown sectors whose vertex list is about to be rebuilt by the queue
+        self._rebuilds = set({})
+
+        # Shown sectors whose vertex list draws blocks hidden since by a neighbor
+        self._outdated_meshes = set({})
+
         # Mapping from sector index a list of positions inside that sector.
         self.sectors = {}
 
         # Actual set of shown sectors
         self.shown_sectors = set({})
 
-        # List of sectors requested but not yet received
-        self.requested = set({})
+        # Mapping from the sectors requested but not yet received to the worker
+        # computing them, or None if they are loaded from `spilled`
+        self.requested = {}
+
+        # Maximum number of sectors loaded in memory. The least recently used
+        # sectors which are not shown are evicted above this limit.
+        self.sector_budget = MAX_LOADED_SECTORS
+
+        # Loaded sectors, ordered from the least to the most recently used
+        self._last_used = OrderedDict()
+
+        # Mapping from position to the compressed description of the edited
+        # sectors which were evicted. They can't be generated again.
+        self.spilled = {}
+
+        # Mapping from sector position to the edits ({position: block or None})
+        # made while the sector was not loaded. They are merged into the sector
+        # when it is registered.
+        self.pending_edits = {}
+
+        # Journal recording the edits of the player, if any
+        self.journal = None
+
+        # Region file of the loaded save, if any. Its sectors are read from it
+        # when they are requested, instead of being generated.
+        self.loader = None
+
+        # Worker decoding the requested sectors of `loader`, nearest first
+        self._streamer = None
+
+        # Vertex lists of the recently hidden sectors, ordered from the least to
+        # the most recently hidden. They are not drawn, but kept in order to be
+        # displayed again without rebuilding them.
+        self._mesh_cache = OrderedDict()
+
+        # Maximum amount of GPU memory (in bytes) used by the cached vertex lists
+        self.mesh_cache_size = MESH_CACHE_SIZE
+        self._mesh_cache_bytes = 0
+
+        # Number of shown sectors which were (or not) found in the cache
+        self.mesh_cache_hits = 0
+        self.mesh_cache_misses = 0
+
+        # Actual frustum of the camera, used to skip the sectors out of sight
+        self._frustum = None
+
+        # Number of sectors drawn during the last frame
+        self.drawn_sectors = 0
+
+        # Cache of the blocks around the player
+        self.occupancy = OccupancyGrid()
+
+        # Filled sectors, grouped in bigger cells to skip the empty space
+        self.hierarchy = OccupancyHierarchy() if OCCUPANCY_LEVELS else None
+
+        # Smallest rays (in blocks) and boxes (in sectors) which use the hierarchy
+        self.hierarchy_min_ray = OCCUPANCY_MIN_RAY_LENGTH
+        self.hierarchy_min_box = OCCUPANCY_MIN_BOX_SECTORS
+
+        # Shown sectors which can be seen from the camera through the empty space
+        self.reachable = set({})
+
+        # True if `reachable` have to be computed again
+        self._reachable_dirty = True
+
+        # Running totals about the content of the model
+        self.stats = WorldStats(self)
 
         # Simple function queue implementation. The queue is populated with
         # _show_block() and _hide_block() calls
         self.queue = deque()
 
+    @property
+    def mesh_cache_hit_rate(self):
+        """Ratio of the shown sectors which were displayed from the mesh cache."""
+        total = self.mesh_cache_hits + self.mesh_cache_misses
+        if total == 0:
+            return 0.0
+        return self.mesh_cache_hits / total
+
     def count_blocks(self):
         """Return the number of blocks in this model"""
-        return sum([len(s.blocks) for s in self.sectors.values()])
+        return self.stats.blocks
 
     @property
     def generator(self):
@@ -255,6 +971,37 @@ class Model(object):
         generator.set_callback(self.on_sector_received)
         self._generator = generator
 
+    @property
+    def frustum(self):
+        return self._frustum
+
+    @frustum.setter
+    def frustum(self, frustum):
+        previous = self._frustum
+        self._frustum = frustum
+        # The faces seen from the sector of the camera depend on the block
+        # of the camera
+        if (previous is None or frustum is None
+                or normalize(previous.position) != normalize(frustum.position)):
+            self._reachable_dirty = True
+
+    @property
+    def streamer(self):
+        return self._streamer
+
+    @streamer.setter
+    def streamer(self, streamer):
+        streamer.set_callback(self.on_sector_loaded)
+        self._streamer = streamer
+
+    def on_sector_loaded(self, chunk):
+        """Called when a sector of the save is decoded.
+
+        This is not executed by the main thread. The sectors are registered by
+        `process_queue`, within the time budget of the frame.
+        """
+        self._enqueue(self.register_sector, chunk)
+
     def on_sector_received(self, chunk):
         """Called when a part of the world is returned.
 
@@ -281,29 +1028,246 @@ class Model(object):
             How many blocks away to search for a hit.
 
         """
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
+        block, previous, _face = self.raycast(position, vector, max_distance)
+        return block, previous
+
+    def raycast(self, position, vector, max_distance=NODE_SELECTOR):
+        """ Search the first block intersected by a ray.
+
+        Each block crossed by the ray is visited once, in order (Amanatides and
+        Woo voxel traversal). The empty sectors are crossed at once, and the
+        rays of at least `hierarchy_min_ray` blocks jump over the biggest empty
+        cell of the hierarchy around them.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) origin of the ray.
+        vector : tuple of len 3
+            The direction of the ray.
+        max_distance : float
+            How many blocks away to search for a hit.
+
+        Returns
+        -------
+        block, previous, face
+            The position of the intersected block, the position of the block
+            crossed just before, and the face of the intersected block hit by the
+            ray (a normalized vector from `FACES`). If the ray starts inside a
+            block, `previous` and `face` are None. If no block is found, return
+            None, None, None.
+
+        """
+        length = math.sqrt(sum(v * v for v in vector))
+        if length == 0:
+            return None, None, None
+        # Blocks are centered on integer locations
+        current = [math.floor(p + 0.5) for p in position]
+        step = [0, 0, 0]
+        t_max = [math.inf, math.inf, math.inf]
+        t_delta = [math.inf, math.inf, math.inf]
+        for axis in range(3):
+            d = vector[axis] / length
+            if d > 0:
+                step[axis] = 1
+                t_max[axis] = (current[axis] + 0.5 - position[axis]) / d
+                t_delta[axis] = 1 / d
+            elif d < 0:
+                step[axis] = -1
+                t_max[axis] = (current[axis] - 0.5 - position[axis]) / d
+                t_delta[axis] = -1 / d
+
+        # Face of the next block hit when moving along each axis
+        faces = [tuple(-step[axis] if i == axis else 0 for i in range(3)) for axis in range(3)]
+
+        hierarchy = self.hierarchy if max_distance >= self.hierarchy_min_ray else None
+
+        sector_pos = None
+        sector = None
         previous = None
-        for _ in range(max_distance * m):
-            checked_position = normalize((x, y, z))
-            if checked_position != previous and not self.empty(checked_position):
-                return checked_position, previous
-            previous = checked_position
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
+        face = None
+        while True:
+            x, y, z = current
+            block = x, y, z
+            # Only look for the sector when the ray enters a new one
+            block_sector_pos = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
+            if block_sector_pos != sector_pos:
+                sector_pos = block_sector_pos
+                sector = self.sectors.get(sector_pos)
+                if sector is None or not sector.blocks:
+                    # Nothing to hit in this sector, jump over the biggest empty
+                    # cell around
+                    cell, size = sector_pos, SECTOR_SIZE
+                    if hierarchy is not None:
+                        level = hierarchy.get_empty_level(sector_pos)
+                        if level:
+                            cell = tuple(v >> level for v in sector_pos)
+                            size = SECTOR_SIZE << level
+                    low = [v * size for v in cell]
+                    high = [v + size - 1 for v in low]
+                    axis, t_exit = self._skip_box(low, high, current, step, t_max, t_delta)
+                    if t_exit > max_distance:
+                        return None, None, None
+                    previous = tuple(current)
+                    current[axis] += step[axis]
+                    t_max[axis] += t_delta[axis]
+                    face = faces[axis]
+                    continue
+            if sector is not None and block in sector.blocks:
+                return block, previous, face
+
+            # Move to the next block crossed by the ray
+            if t_max[0] < t_max[1]:
+                axis = 0 if t_max[0] < t_max[2] else 2
+            else:
+                axis = 1 if t_max[1] < t_max[2] else 2
+            if t_max[axis] > max_distance:
+                return None, None, None
+            previous = block
+            current[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+            face = faces[axis]
+
+    @staticmethod
+    def _skip_box(low, high, current, step, t_max, t_delta):
+        """Move the state of a voxel traversal to the last block crossed inside
+        a box of blocks from `low` to `high` (both included), just before
+        leaving it.
+
+        `current` and `t_max` are updated in place. Returns the axis along which
+        the ray leaves the box, and the time it does.
+        """
+        # Time to leave the box along each axis
+        remaining = [0, 0, 0]
+        t_exit = [math.inf, math.inf, math.inf]
+        for axis in range(3):
+            if step[axis] > 0:
+                remaining[axis] = high[axis] - current[axis]
+            elif step[axis] < 0:
+                remaining[axis] = current[axis] - low[axis]
+            else:
+                continue
+            t_exit[axis] = t_max[axis] + remaining[axis] * t_delta[axis]
+        if t_exit[0] < t_exit[1]:
+            exit_axis = 0 if t_exit[0] < t_exit[2] else 2
+        else:
+            exit_axis = 1 if t_exit[1] < t_exit[2] else 2
+        time = t_exit[exit_axis]
+        # Move to the last block crossed before leaving the box
+        for axis in range(3):
+            if axis == exit_axis:
+                crossed = remaining[axis]
+            elif t_max[axis] < time:
+                crossed = min(math.ceil((time - t_max[axis]) / t_delta[axis]), remaining[axis])
+            else:
+                continue
+            current[axis] += crossed * step[axis]
+            t_max[axis] += crossed * t_delta[axis]
+        return exit_axis, time
+
+    def find_block(self, low, high):
+        """ Search a block between the block positions `low` and `high` (both
+        included).
+
+        Only the loaded sectors are searched. The empty regions are skipped
+        with the hierarchy of the filled sectors, if it is enabled and the box
+        covers at least `hierarchy_min_box` sectors.
+
+        Returns
+        -------
+        position : tuple of len 3
+            The position of one of the blocks of the box, or None if the box
+            is empty.
+
+        """
+        sector_low = sectorize(low)
+        sector_high = sectorize(high)
+        nb_sectors = 1
+        for axis in range(3):
+            nb_sectors *= sector_high[axis] - sector_low[axis] + 1
+        # Walking the hierarchy is only worth it for the boxes over many sectors
+        if self.hierarchy is not None and nb_sectors >= self.hierarchy_min_box:
+            sector_positions = self.hierarchy.iter_filled_sectors(sector_low, sector_high)
+        else:
+            sector_positions = itertools.product(*[range(a, b + 1) for a, b in zip(sector_low, sector_high)])
+        for sector_pos in sector_positions:
+            sector = self.sectors.get(sector_pos)
+            if sector is None:
+                continue
+            bounds = sector.get_bounds()
+            if bounds is None:
+                continue
+            # Search inside the part of the box containing blocks
+            box_low = [max(a, b) for a, b in zip(low, bounds[0])]
+            box_high = [min(a, b) for a, b in zip(high, bounds[1])]
+            if box_low[0] > box_high[0] or box_low[1] > box_high[1] or box_low[2] > box_high[2]:
+                continue
+            volume = 1
+            for axis in range(3):
+                volume *= box_high[axis] - box_low[axis] + 1
+            blocks = sector.blocks
+            if volume < len(blocks):
+                for position in iter_box((box_low, box_high)):
+                    if position in blocks:
+                        return position
+            else:
+                for position in blocks:
+                    if (box_low[0] <= position[0] <= box_high[0]
+                            and box_low[1] <= position[1] <= box_high[1]
+                            and box_low[2] <= position[2] <= box_high[2]):
+                        return position
+        return None
+
+    def _update_hierarchy(self, sector):
+        """Update the hierarchy of the filled sectors after a change of a sector."""
+        if self.hierarchy is not None:
+            filled = bool(sector.blocks) and sector.position in self.sectors
+            self.hierarchy.update_sector(sector.position, filled)
+
+    def raycast_many(self, rays, max_distance=NODE_SELECTOR):
+        """ Search the first block intersected by many rays.
+
+        Parameters
+        ----------
+        rays : iterable of (position, vector)
+            The origin and the direction of each ray.
+        max_distance : float
+            How many blocks away to search for a hit.
+
+        Returns
+        -------
+        list of (block, previous, face)
+            The result of `raycast` for each ray, in the same order.
+
+        """
+        return [self.raycast(position, vector, max_distance) for position, vector in rays]
 
     def empty(self, position, must_be_loaded=False):
         """ Returns True if given `position` does not contain block.
 
         If `must_be_loaded` is True, this returns False if the block is not yet loaded.
         """
+        cell = self.occupancy.get(position)
+        if cell is not None:
+            if cell == OccupancyGrid.NOT_LOADED:
+                return not must_be_loaded
+            return cell == OccupancyGrid.EMPTY
+
         sector_pos = sectorize(position)
         sector = self.sectors.get(sector_pos, None)
         if sector is None:
             return not must_be_loaded
         return sector.empty(position)
 
+    def focus_on(self, position):
+        """ Move the cache of the blocks around the player, if the player
+        entered a new sector.
+
+        """
+        sector_pos = sectorize(position)
+        if self.occupancy.center != sector_pos:
+            self.occupancy.recenter(self.sectors, sector_pos)
+
     def exposed(self, position):
         """ Returns False if given `position` is surrounded on all 6 sides by
         blocks, True otherwise.
@@ -332,14 +1296,24 @@ class Model(object):
         sector_pos = sectorize(position)
         sector = self.sectors.get(sector_pos, None)
         if sector is None:
-            # Sector not yet loaded
-            # It would be better to create it
-            # and then to merge it when the sector is loaded
+            # Sector not yet loaded, the block is added when it is registered
+            self.pending_edits.setdefault(sector_pos, {})[position] = block
+            if self.journal is not None:
+                self.journal.record(position, UNKNOWN_BLOCK, block)
             return
 
         if position in sector.blocks:
             self.remove_block(position, immediate)
+        if self.journal is not None:
+            self.journal.record(position, None, block)
         sector.add_block(position, block)
+        self._update_neighbor_blocks(sector, (position,))
+        self.stats.add_block(block)
+        self.occupancy.set(position, OccupancyGrid.BLOCK)
+        sector.modified = True
+        self._reachable_dirty = True
+        self._touch_sector(sector_pos)
+        self._update_hierarchy(sector)
         self._enqueue(self.update_batch_sector, sector)
 
     def remove_block(self, position, immediate=True):
@@ -356,32 +1330,134 @@ class Model(object):
         sector_pos = sectorize(position)
         sector = self.sectors.get(sector_pos)
         if sector is None:
-            # Nothing to do
+            # Sector not yet loaded, the block is removed when it is registered
+            self.pending_edits.setdefault(sector_pos, {})[position] = None
+            if self.journal is not None:
+                self.journal.record(position, UNKNOWN_BLOCK, None)
             return
 
         if position not in sector.blocks:
             # Nothing to do
             return
 
-
+        if self.journal is not None:
+            self.journal.record(position, sector.blocks[position], None)
+        self.stats.remove_block(sector.blocks[position])
         discarded = sector.remove_block(position)
+        self._update_neighbor_blocks(sector, (position,))
+        self.occupancy.set(position, OccupancyGrid.EMPTY)
+        sector.modified = True
+        self._reachable_dirty = True
+        self._touch_sector(sector_pos)
+        self._update_hierarchy(sector)
 
-        # Removing a block can make a neighbor section visible
         if discarded:
-            x, y, z = sector.position
-            for dx, dy, dz in discarded:
-                neighbor_pos = x + dx, y + dy, z + dz
-                if neighbor_pos in self.sectors:
-                    continue
-                if neighbor_pos in self.requested:
-                    continue
-                if neighbor_pos not in self.shown_sectors:
-                    continue
-                neighbor = self.generator.generate(neighbor_pos)
-                self.register_sector(neighbor)
+            self._request_opened_neighbors(sector, discarded)
 
         self._enqueue(self.update_batch_sector, sector)
 
+    def _request_opened_neighbors(self, sector, faces):
+        """Request the shown neighbors of a sector behind `faces`, which are
+        not full anymore.
+
+        Removing a block can make a neighbor section visible, so it is requested
+        before the sectors requested by the display. The request only raises
+        the priority of a sector already pending, and does nothing for a sector
+        which is being computed or waiting in the queue.
+        """
+        x, y, z = sector.position
+        for dx, dy, dz in faces:
+            if sector.neighbors[FACES.index((dx, dy, dz))] is not None:
+                continue
+            neighbor_pos = x + dx, y + dy, z + dz
+            if neighbor_pos not in self.shown_sectors:
+                continue
+            self.request_sector(neighbor_pos, EDIT_PRIORITY)
+
+    def apply(self, changes):
+        """ Change many blocks at once.
+
+        The changes are grouped by sector. Each touched sector updates its
+        visible blocks once, and is rebuilt once. It is much faster than calling
+        `add_block` or `remove_block` for each block.
+
+        Parameters
+        ----------
+        changes : mapping or iterable of (position, block)
+            The new block at each (x, y, z) position, or None to remove the block.
+
+        """
+        if isinstance(changes, dict):
+            changes = changes.items()
+        by_sector = {}
+        for position, block in changes:
+            sector_changes = by_sector.setdefault(sectorize(position), {})
+            sector_changes[position] = block
+
+        journal = self.journal
+        for sector_pos, sector_changes in by_sector.items():
+            sector = self.sectors.get(sector_pos)
+            if sector is None:
+                # Sector not yet loaded, the blocks are changed when it is registered
+                self.pending_edits.setdefault(sector_pos, {}).update(sector_changes)
+                if journal is not None:
+                    for position, block in sector_changes.items():
+                        journal.record(position, UNKNOWN_BLOCK, block)
+                continue
+            blocks = sector.blocks
+            for position, block in sector_changes.items():
+                previous = blocks.get(position)
+                if journal is not None:
+                    journal.record(position, previous, block)
+                if previous is not None:
+                    self.stats.remove_block(previous)
+                if block is not None:
+                    self.stats.add_block(block)
+            discarded = sector.set_blocks(sector_changes)
+            self._update_neighbor_blocks(sector, sector_changes)
+            if discarded:
+                self._request_opened_neighbors(sector, discarded)
+            for position, block in sector_changes.items():
+                value = OccupancyGrid.EMPTY if block is None else OccupancyGrid.BLOCK
+                self.occupancy.set(position, value)
+            sector.modified = True
+            self._touch_sector(sector_pos)
+            self._update_hierarchy(sector)
+            self._enqueue(self.update_batch_sector, sector)
+        self._reachable_dirty = True
+
+    def fill(self, box, block):
+        """ Fill a box with a block.
+
+        Parameters
+        ----------
+        box : tuple of 2 positions
+            Two opposite corners of the box, both included.
+        block : Block object
+            The block to place, or None to remove all the blocks of the box.
+
+        """
+        self.apply((position, block) for position in iter_box(box))
+
+    def replace(self, box, from_block, to_block):
+        """ Replace a kind of block by another one, inside a box.
+
+        Parameters
+        ----------
+        box : tuple of 2 positions
+            Two opposite corners of the box, both included.
+        from_block : Block object
+            The block to replace, or None to fill the empty locations.
+        to_block : Block object
+            The new block, or None to remove the blocks.
+
+        """
+        changes = []
+        for position in iter_box(box):
+            if self.get_block(position) is from_block:
+                changes.append((position, to_block))
+        self.apply(changes)
+
     def get_block(self, position):
         """Return a block from this position.
 
@@ -394,14 +1470,21 @@ class Model(object):
         return sector.blocks.get(position, None)
 
     def update_batch_sector(self, sector):
+        self._rebuilds.discard(sector.position)
+        self._outdated_meshes.discard(sector.position)
+        if self.sectors.get(sector.position) is not sector:
+            # The sector was evicted in the meantime
+            return
         visible = sector.position in self.shown_sectors
 
         # Clean up previous description
         block = self._shown.pop(sector.position, None)
         if block:
+            self.stats.remove_mesh(block)
             block.delete()
+        self._drop_cached_mesh(sector.position)
 
-        if visible:
+        if visible and sector.visible:
             points = len(sector.visible) * 24
             vertex_data = []
             tex_coords = []
@@ -419,41 +1502,112 @@ class Model(object):
                                          ('v3f/static', vertex_data),
                                          ('t2f/static', tex_coords))
             self._shown[sector.position] = vertex_list
+            self.stats.add_mesh(vertex_list)
 
     def register_sector(self, sector):
         """Add a new sector to this world definition.
+
+        A sector already loaded is dropped. It can only be a late result of
+        another worker, which is older than the loaded sector.
         """
-        # Assert if the sector is already there.
-        # It also could be skipped, or merged together.
-        assert sector.position not in self.sectors
-        self.requested.discard(sector.position)
+        if self.generator is not None:
+            self.generator.release_sector(sector.position)
+        if self.streamer is not None:
+            self.streamer.release_sector(sector.position)
+        if sector.position in self.sectors:
+            return
+        self.requested.pop(sector.position, None)
+        edits = self.pending_edits.pop(sector.position, None)
+        if edits:
+            sector.set_blocks(edits)
+            sector.modified = True
+        self.stats.add_sector(sector)
         self.sectors[sector.position] = sector
+        self._link_sector(sector)
+        self.occupancy.fill_sector(sector)
+        self._update_hierarchy(sector)
+        self._touch_sector(sector.position)
         if sector.position not in self.shown_sectors:
             return
 
         # Update the displayed blocks
-        self._enqueue(self.update_batch_sector, sector)
+        self._rebuild_sector(sector)
+
+        # Sectors around could be visible through this one
+        self._reachable_dirty = True
+
+    def _link_sector(self, sector):
+        """Connect a registered sector with its loaded neighbors.
 
-        # Is sector around have to be loaded too?
+        The blocks on the shared faces hidden by the other sector are not
+        visible anymore. The vertex list of a neighbor still draws them, which
+        is only a waste, so it is rebuilt once all its shown neighbors are
+        loaded, instead of once per neighbor.
+        """
         x, y, z = sector.position
-        for face in FACES:
-            # The sector have to be accessible
-            if sector.is_face_full(face):
-                continue
-            pos = x + face[0], y + face[1], z + face[2]
-            # Must not be already loaded
-            if pos in self.sectors:
+        for i, (dx, dy, dz) in enumerate(FACES):
+            neighbor = self.sectors.get((x + dx, y + dy, z + dz))
+            sector.neighbors[i] = neighbor
+            if neighbor is None:
                 continue
-            # Must be shown actually
-            if pos not in self.shown_sectors:
+            neighbor.neighbors[opposite_face(i)] = sector
+            sector.update_border(i)
+            if neighbor.update_border(opposite_face(i)) and neighbor.position in self.shown_sectors:
+                self._outdated_meshes.add(neighbor.position)
+            if neighbor.position in self._outdated_meshes and self._is_surrounded(neighbor):
+                self._rebuild_sector(neighbor)
+
+    def _is_surrounded(self, sector):
+        """True if the shown neighbors of a sector are loaded."""
+        x, y, z = sector.position
+        for i, (dx, dy, dz) in enumerate(FACES):
+            if sector.neighbors[i] is None and (x + dx, y + dy, z + dz) in self.shown_sectors:
+                return False
+        return True
+
+    def _unlink_sector(self, sector):
+        """Disconnect an unregistered sector from its neighbors.
+
+        The blocks of the neighbors it was hiding are visible again."""
+        for i, neighbor in enumerate(sector.neighbors):
+            sector.neighbors[i] = None
+            if neighbor is None:
                 continue
-            # Must not be already requested
-            if pos in self.requested:
+            neighbor.neighbors[opposite_face(i)] = None
+            if neighbor.update_border(opposite_face(i)):
+                self._rebuild_sector(neighbor)
+
+    def _update_neighbor_blocks(self, sector, positions):
+        """Update the visibility of the blocks of the neighbors of a sector
+        touching its edited `positions`. The shown neighbors which changed are
+        rebuilt."""
+        changed = set({})
+        for position in positions:
+            if not sector.on_outline(position):
                 continue
-            # Then request the sector
-            if self.generator is not None:
-                self.requested.add(pos)
-                self.generator.request_sector(pos)
+            x, y, z = position
+            for i, (dx, dy, dz) in enumerate(FACES):
+                neighbor = sector.neighbors[i]
+                if neighbor is None:
+                    continue
+                pos = (x + dx, y + dy, z + dz)
+                if neighbor.contains(pos) and neighbor.update_visible(pos):
+                    changed.add(neighbor)
+        for neighbor in changed:
+            self._rebuild_sector(neighbor)
+
+    def _rebuild_sector(self, sector):
+        """Rebuild the vertex list of a sector later, if it is shown. Else its
+        cached vertex list is outdated."""
+        sector_pos = sector.position
+        if sector_pos not in self.shown_sectors:
+            self._drop_cached_mesh(sector_pos)
+            return
+        if sector_pos in self._rebuilds:
+            # Already in the queue
+            return
+        self._rebuilds.add(sector_pos)
+        self._enqueue(self.update_batch_sector, sector)
 
     def show_sector(self, sector_pos):
         """ Ensure all blocks in the given sector that should be shown are
@@ -462,34 +1616,230 @@ class Model(object):
         self.shown_sectors.add(sector_pos)
         sector = self.sectors.get(sector_pos, None)
         if sector is None:
-            if sector_pos in self.requested:
-                # Already requested
-                return
-            # If sectors around not yet loaded
-            if not self.is_sector_visible(sector_pos):
-                return
-            if self.generator is not None:
-                # This sector is about to be loaded
-                self.requested.add(sector_pos)
-                self.generator.request_sector(sector_pos)
-                return
+            if self.loader is not None and sector_pos in self.loader:
+                # Reading the save is cheap, no need to wait for the search
+                # of the reachable sectors
+                self.request_sector(sector_pos, self.sector_priority(sector_pos))
+            # It will be requested if it is reachable from the camera
+            self._reachable_dirty = True
+            return
 
+        self._touch_sector(sector_pos)
+        vertex_list = self._mesh_cache.pop(sector_pos, None)
+        if vertex_list is not None:
+            # Displayed again as it was hidden
+            self.mesh_cache_hits += 1
+            self._mesh_cache_bytes -= self._mesh_size(vertex_list)
+            self._shown[sector_pos] = vertex_list
+            self.stats.add_mesh(vertex_list)
+            return
+        self.mesh_cache_misses += 1
         self._enqueue(self.update_batch_sector, sector)
 
-    def is_sector_visible(self, sector_pos):
-        """Check if a sector is visible.
+    def _mesh_size(self, vertex_list):
+        """Returns the amount of GPU memory used by a vertex list of a sector.
+
+        Each vertex uses 3 floats for its position and 2 for its texture."""
+        return vertex_list.get_size() * 5 * 4
+
+    def _cache_mesh(self, sector_pos, vertex_list):
+        """Keep the vertex list of a hidden sector, in case it is shown again."""
+        self._mesh_cache[sector_pos] = vertex_list
+        self._mesh_cache_bytes += self._mesh_size(vertex_list)
+        while self._mesh_cache_bytes > self.mesh_cache_size:
+            oldest = next(iter(self._mesh_cache))
+            self._drop_cached_mesh(oldest)
+
+    def _drop_cached_mesh(self, sector_pos):
+        """Release the cached vertex list of a sector, if any."""
+        vertex_list = self._mesh_cache.pop(sector_pos, None)
+        if vertex_list is not None:
+            self._mesh_cache_bytes -= self._mesh_size(vertex_list)
+            vertex_list.delete()
+
+    def sector_priority(self, sector_pos):
+        """Returns the priority used to request a shown sector.
 
-        For now only check if no from a sector position.
+        The priority is between 0 and 1 for the sectors inside the frustum, and
+        between 2 and 3 for the others, and grows with the distance to the camera.
         """
-        x, y, z = sector_pos
-        for dx, dy, dz in FACES:
-            pos = (x + dx, y + dy, z + dz)
-            neighbor = self.sectors.get(pos, None)
-            if neighbor is not None:
-                neighbor_face = (-dx, -dy, -dz)
-                if not neighbor.is_face_full(neighbor_face):
-                    return True
-        return False
+        frustum = self.frustum
+        if frustum is None:
+            return 0
+        half = SECTOR_SIZE / 2
+        x, y, z = frustum.position
+        dx = sector_pos[0] * SECTOR_SIZE + half - x
+        dy = sector_pos[1] * SECTOR_SIZE + half - y
+        dz = sector_pos[2] * SECTOR_SIZE + half - z
+        distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+        priority = distance / (distance + FOG_END)
+        if not frustum.intersects_sector(sector_pos):
+            priority += 2
+        return priority
+
+    def update_requested_priorities(self):
+        """Update the priority of the shown sectors which are not yet loaded,
+        after a change of the frustum."""
+        for sector_pos in self.requested.keys() & self.shown_sectors:
+            self.request_sector(sector_pos, self.sector_priority(sector_pos))
+
+    def request_sector(self, sector_pos, priority=0):
+        """Request the generation of a sector which is not yet loaded.
+
+        Requests with the smallest `priority` are computed first. Returns True
+        if the sector is loaded or about to be loaded.
+
+        A sector already requested stays with the worker it was sent to, which
+        only updates its priority. The source of a sector can change while it
+        is computed, for example when a save is completed, and it would else be
+        received twice.
+        """
+        if sector_pos in self.sectors:
+            return True
+        if sector_pos in self.requested:
+            worker = self.requested[sector_pos]
+            if worker is not None:
+                worker.request_sector(sector_pos, priority)
+            return True
+        if sector_pos in self.spilled:
+            self.requested[sector_pos] = None
+            self._enqueue(self._load_spilled_sector, sector_pos)
+            return True
+        if self.loader is not None and sector_pos in self.loader:
+            worker = self.streamer
+        elif self.generator is not None:
+            worker = self.generator
+        else:
+            return False
+        self.requested[sector_pos] = worker
+        worker.request_sector(sector_pos, priority)
+        return True
+
+    def _load_spilled_sector(self, sector_pos):
+        """Register again an edited sector which was evicted."""
+        data = self.spilled.pop(sector_pos)
+        sector = Sector.load(sector_pos, data)
+        sector.modified = True
+        self.register_sector(sector)
+
+    def get_saved_sectors(self):
+        """Returns a `SavedSectors` snapshot of the content of the world which
+        have to be written in a save.
+
+        Only references to immutable data and a copy of the pending edits are
+        taken, so this is cheap enough to be done while playing. The block
+        identifiers are computed by `SavedSectors.build`, which can be called
+        by another thread.
+        """
+        loaded = {}
+        for sector_pos, sector in self.sectors.items():
+            if sector.modified:
+                loaded[sector_pos] = sector.get_block_ids()
+        edits = {sector_pos: dict(changes) for sector_pos, changes in self.pending_edits.items()}
+        return SavedSectors(loaded, dict(self.spilled), edits, self.loader, self.generator)
+
+    def _touch_sector(self, sector_pos):
+        """Mark a loaded sector as the most recently used one."""
+        self._last_used[sector_pos] = None
+        self._last_used.move_to_end(sector_pos)
+
+    def evict_sectors(self):
+        """Unload the least recently used sectors which are not shown, until
+        the number of loaded sectors fits into `sector_budget`.
+
+        Unmodified sectors are simply dropped, as they can be generated or read
+        from the save again.
+        Edited sectors are compressed into `spilled`, and loaded back from
+        there when requested again.
+        """
+        candidates = list(self._last_used)
+        for sector_pos in candidates:
+            if len(self.sectors) <= self.sector_budget:
+                break
+            if sector_pos in self.shown_sectors:
+                # Still in use
+                self._last_used.move_to_end(sector_pos)
+                continue
+            self.unregister_sector(sector_pos)
+
+    def unregister_sector(self, sector_pos):
+        """Remove a loaded sector from this world definition."""
+        sector = self.sectors.pop(sector_pos)
+        self._rebuilds.discard(sector_pos)
+        self._outdated_meshes.discard(sector_pos)
+        self._unlink_sector(sector)
+        self.occupancy.clear_sector(sector_pos)
+        self._update_hierarchy(sector)
+        del self._last_used[sector_pos]
+        self.stats.remove_sector(sector)
+        vertex_list = self._shown.pop(sector_pos, None)
+        if vertex_list:
+            self.stats.remove_mesh(vertex_list)
+            vertex_list.delete()
+        self._drop_cached_mesh(sector_pos)
+        if sector.modified:
+            self.spilled[sector_pos] = sector.dump()
+        self._reachable_dirty = True
+
+    def update_reachable(self):
+        """Search the shown sectors which can be seen from the camera.
+
+        This is a breadth first search from the sector of the camera. A sector
+        is reachable if one of its neighbors is reachable, and if we can see through
+        this neighbor, from the face we entered it to the face shared with the
+        sector (see `Sector.get_connectivity`). The search never goes back to the
+        direction of the camera.
+
+        Sectors not yet loaded are reachable, but can't be crossed. The reachable
+        ones are requested, and the search is done again once they are loaded,
+        and when the camera enters another block.
+        """
+        self._reachable_dirty = False
+        if self.frustum is None:
+            # No camera, everything is visible
+            self.reachable = set(self.shown_sectors)
+            return
+
+        camera = self.frustum.position
+        # The sector of the block of the camera, also used by `get_faces_seen_from`
+        start = sectorize(normalize(camera))
+        reachable = {start}
+        # Sector, index of the entry face, bit mask of the directions taken
+        queue = deque([(self.sectors.get(start), None, 0)])
+        while queue:
+            sector, entry, directions = queue.popleft()
+            if sector is None:
+                continue
+            if entry is None:
+                faces_seen = sector.get_faces_seen_from(camera)
+            x, y, z = sector.position
+            neighbors = sector.neighbors
+            for i, (dx, dy, dz) in enumerate(FACES):
+                if directions & (1 << opposite_face(i)):
+                    # Going back to the camera
+                    continue
+                if entry is None:
+                    if not faces_seen & (1 << i):
+                        continue
+                elif not sector.is_connected(entry, i):
+                    continue
+                neighbor = neighbors[i]
+                if neighbor is not None:
+                    neighbor_pos = neighbor.position
+                else:
+                    neighbor_pos = x + dx, y + dy, z + dz
+                if neighbor_pos in reachable:
+                    continue
+                if neighbor_pos not in self.shown_sectors:
+                    continue
+                reachable.add(neighbor_pos)
+                queue.append((neighbor, opposite_face(i), directions | (1 << i)))
+
+        self.reachable = reachable
+        for sector_pos in reachable:
+            if sector_pos in self.sectors or sector_pos in self.requested:
+                continue
+            self.request_sector(sector_pos, self.sector_priority(sector_pos))
 
     def hide_sector(self, sector_pos):
         """ Ensure all blocks in the given sector that should be hidden are
@@ -497,16 +1847,25 @@ class Model(object):
 
         """
         self.shown_sectors.discard(sector_pos)
-        sector = self.sectors.get(sector_pos, None)
-        if sector is not None:
-            self._enqueue(self.update_batch_sector, sector)
+        self._outdated_meshes.discard(sector_pos)
+        vertex_list = self._shown.pop(sector_pos, None)
+        if vertex_list is not None:
+            self.stats.remove_mesh(vertex_list)
+            self._cache_mesh(sector_pos, vertex_list)
 
-    def show_only_sectors(self, sector_positions):
+    def show_only_sectors(self, sector_positions, keep_positions=None):
         """ Update the shown sectors.
 
         Show the ones which are not part of the list, and hide the others.
+
+        If `keep_positions` is specified, the already shown sectors which are part
+        of it are not hidden. It is usually a wider area than `sector_positions`,
+        so that the sectors on the border are not hidden and shown again when the
+        player moves back and forth.
         """
-        after_set = set(sector_positions)
+        if keep_positions is None:
+            keep_positions = sector_positions
+        after_set = set(keep_positions)
         before_set = self.shown_sectors
         hide = before_set - after_set
         # Use a list to respect the order of the sectors
@@ -515,6 +1874,33 @@ class Model(object):
             self.show_sector(sector_pos)
         for sector_pos in hide:
             self.hide_sector(sector_pos)
+        self._reachable_dirty = True
+        if len(self.sectors) > self.sector_budget:
+            self.evict_sectors()
+
+    def draw(self):
+        """ Draw the shown sectors which are inside the frustum.
+
+        The OpenGL state of the block group have to be already set.
+        """
+        frustum = self.frustum
+        reachable = self.reachable
+        if frustum is None:
+            vertex_lists = list(self._shown.values())
+        else:
+            vertex_lists = []
+            for sector_pos, vertex_list in self._shown.items():
+                if sector_pos not in reachable:
+                    continue
+                # Only the box containing the blocks have to be inside the frustum
+                bounds = self.sectors[sector_pos].get_bounds()
+                if bounds is None:
+                    continue
+                low, high = bounds
+                if frustum.intersects_box([v - 0.5 for v in low], [v + 0.5 for v in high]):
+                    vertex_lists.append(vertex_list)
+        self.drawn_sectors = len(vertex_lists)
+        draw_vertex_lists(GL_QUADS, vertex_lists)
 
     def _enqueue(self, func, *args):
         """ Add `func` to the internal queue.
@@ -537,6 +1923,8 @@ class Model(object):
 
         """
         start = time.perf_counter()
+        if self._reachable_dirty:
+            self.update_reachable()
         while self.queue and time.perf_counter() - start < 1.0 / TICKS_PER_SEC:
             self._dequeue()
 
@@ -544,5 +1932,50 @@ class Model(object):
         """ Process the entire queue with no breaks.
 
         """
+        if self._reachable_dirty:
+            self.update_reachable()
         while self.queue:
             self._dequeue()
+
+
+if __name__ == '__main__':
+    # Benchmark of the culling of the blocks hidden by the neighbor sectors:
+    # python -m game.world
+    from .genworld import WorldGenerator
+
+    def vertex_time(visible_sets):
+        """Time to compute the vertices of the meshes, like `update_batch_sector`"""
+        start = time.perf_counter()
+        for visible in visible_sets:
+            vertex_data = []
+            for x, y, z in visible:
+                vertex_data.extend(cube_vertices(x, y, z, 0.5))
+        return time.perf_counter() - start
+
+    generator = WorldGenerator(seed=0)
+    generator.enclosure = False
+    positions = [(x, y, z) for x in range(-4, 4) for y in range(-3, 2) for z in range(-4, 4)]
+    sectors = [generator.generate(position) for position in positions]
+    alone = [set(sector.visible) for sector in sectors]
+
+    model = Model(None, None)
+    start = time.perf_counter()
+    for sector in sectors:
+        model.register_sector(sector)
+    register_time = time.perf_counter() - start
+    linked = [sector.visible for sector in sectors]
+
+    start = time.perf_counter()
+    for sector in sectors:
+        for i in range(len(FACES)):
+            sector.update_border(i)
+    border_time = time.perf_counter() - start
+
+    count = len(sectors)
+    print("%d sectors of underworld" % count)
+    print("%-24s %16s %16s" % ("", "sector alone", "with neighbors"))
+    print("%-24s %16d %16d" % ("visible blocks", sum(map(len, alone)), sum(map(len, linked))))
+    print("%-24s %16.2f %16.2f" % ("vertices, ms/sector", vertex_time(alone) / count * 1000,
+                                   vertex_time(linked) / count * 1000))
+    print("register: %.2f ms/sector, update of the 6 faces of a sector: %.2f ms" % (
+        register_time / count * 1000, border_time / count * 1000))
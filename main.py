@@ -60,6 +60,9 @@ def main():
     setup_opengl()
     pyglet.app.run()
 
+    # Write what is still pending before exiting
+    scene_manager.save.close()
+
 
 if __name__ == '__main__':
     main()